@@ -1,5 +1,9 @@
+import argparse
 import asyncio
+import json
 import os
+import sys
+import time
 from pathlib import Path
 from llama_index.core import (
     VectorStoreIndex,
@@ -52,6 +56,55 @@ async def load_or_build_index():
     return index
 
 
+def run_batch(questions_path: Path, output_path: Path | None, filters: dict | None, sequential: bool):
+    """Answers a file of questions, one per line, through the agent service."""
+    import requests
+
+    agent_service_url = os.getenv("AGENT_SERVICE_URL", "http://localhost:8001")
+    questions = [
+        line.strip()
+        for line in questions_path.read_text(encoding="utf-8").splitlines()
+        if line.strip()
+    ]
+    output = open(output_path, "w", encoding="utf-8") if output_path else sys.stdout
+    start = time.perf_counter()
+    try:
+        if sequential:
+            # One /query call per question, to compare against the batch endpoint
+            for index, question in enumerate(questions):
+                response = requests.post(
+                    f"{agent_service_url}/query",
+                    json={"query": question, "filters": filters},
+                )
+                result = {"index": index, "query": question}
+                if response.ok:
+                    result["response"] = response.json()["response"]
+                else:
+                    result["error"] = response.text
+                output.write(json.dumps(result) + "\n")
+        else:
+            # Answers are streamed back as NDJSON lines as each one finishes
+            with requests.post(
+                f"{agent_service_url}/query/batch",
+                json={"queries": questions, "filters": filters},
+                stream=True,
+            ) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if line:
+                        output.write(line.decode("utf-8") + "\n")
+                        output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    seconds = time.perf_counter() - start
+    print(
+        f"Answered {len(questions)} questions in {seconds:.1f}s "
+        f"({len(questions) / seconds:.2f} questions/sec)",
+        file=sys.stderr,
+    )
+
+
 async def main():
     # Step 1: Setup global Settings
     Settings.embed_model = OpenAIEmbedding(api_key=os.getenv("OPENAI_API_KEY"))
@@ -77,4 +130,25 @@ async def main():
         print(f"Bot: {response}\n")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--batch",
+        type=Path,
+        help="File of questions, one per line, to answer through the agent service.",
+    )
+    parser.add_argument(
+        "--output", type=Path, help="NDJSON file for batch answers. Defaults to stdout."
+    )
+    parser.add_argument(
+        "--filters", type=json.loads, help='Metadata filters, e.g. \'{"origin": "source"}\'.'
+    )
+    parser.add_argument(
+        "--sequential",
+        action="store_true",
+        help="Call /query once per question instead of /query/batch.",
+    )
+    args = parser.parse_args()
+    if args.batch:
+        run_batch(args.batch, args.output, args.filters, args.sequential)
+    else:
+        asyncio.run(main())
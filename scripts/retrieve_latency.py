@@ -0,0 +1,61 @@
+"""Compares the latency of /retrieve and /query on the agent service."""
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def measure(url: str, payloads: list[dict]) -> dict[str, float]:
+    """Posts each payload once and summarizes the latency in milliseconds."""
+    latencies = []
+    for payload in payloads:
+        start = time.perf_counter()
+        requests.post(url, json=payload).raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "p50_ms": round(latencies[len(latencies) // 2], 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)], 1),
+        "mean_ms": round(sum(latencies) / len(latencies), 1),
+    }
+
+
+def main(args: argparse.Namespace):
+    agent_service_url = os.getenv("AGENT_SERVICE_URL", "http://localhost:8001")
+    questions = [
+        line.strip()
+        for line in args.questions.read_text(encoding="utf-8").splitlines()
+        if line.strip()
+    ]
+    retrieve_payloads = [{"query": q, "top_k": args.top_k} for q in questions]
+
+    results = {
+        # First pass embeds and searches, the second is served from the cache
+        "retrieve (cold)": measure(f"{agent_service_url}/retrieve", retrieve_payloads),
+        "retrieve (cached)": measure(f"{agent_service_url}/retrieve", retrieve_payloads),
+    }
+    if not args.skip_query:
+        results["query"] = measure(
+            f"{agent_service_url}/query", [{"query": q} for q in questions]
+        )
+    for name, metrics in results.items():
+        values = ", ".join(f"{key}={value}" for key, value in metrics.items())
+        print(f"{name:<20} {values}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "questions", type=Path, help="File of questions, one per line."
+    )
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument(
+        "--skip-query", action="store_true", help="Only measure /retrieve."
+    )
+    main(parser.parse_args())
@@ -1,47 +1,179 @@
+import asyncio
+import hmac
+import json
 import os
+import random
+import sys
 from pathlib import Path
 from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from llama_index.core import (
-    VectorStoreIndex,
-    StorageContext,
-    load_index_from_storage,
-    Settings,
-)
-from llama_index.llms.openai import OpenAI
-from llama_index.embeddings.openai import OpenAIEmbedding
-from llama_index.readers.file import PDFReader
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.datastructures import Headers
+from pydantic import BaseModel, Field
+
+from caching import LRUCache
+from coalescing import SingleFlight, normalize_query
+from conversation import ConversationStore
+
+# The profiler, vector indexes and ONNX model are shared with the ingest
+# pipeline in vector_store/, which retrievers and local_embeddings import from
+sys.path.append(str(Path(__file__).resolve().parent.parent / "vector_store"))
+from profiling import StageProfiler  # noqa: E402
 
 from dotenv import load_dotenv
 
+# LlamaIndex and the retrievers are imported by initialize(), in the
+# background, so the app starts serving /health before they are loaded
+if TYPE_CHECKING:
+    from llama_index.core import VectorStoreIndex
+    from partitioned_index import PartitionedIndex
+    from retrievers import PGVectorRetriever
+
 load_dotenv()
 
 # Config
 ROOT_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = ROOT_DIR / "data"
 STORAGE_DIR = ROOT_DIR / "storage"
+VECTORS_DIR = STORAGE_DIR / "vectors"
+
+# "none" to search full precision vectors, or "int8" / "binary" to search
+# quantized vectors and rescore the best candidates from vectors kept on disk,
+# RESCORE_FACTOR * top_k of them, by default 4 for int8 and 256 for binary
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR") or 0) or None
+
+# "local" to search the index in storage/, or "pgvector" to search the
+# collection written by the ingest pipeline, embedding queries with the same
+# model it was ingested with
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "local")
+PGVECTOR_COLLECTION = os.getenv("PGVECTOR_COLLECTION", "source_collection")
+PGVECTOR_POOL_SIZE = int(os.getenv("PGVECTOR_POOL_SIZE", 10))
+PGVECTOR_EF_SEARCH = int(os.getenv("PGVECTOR_EF_SEARCH") or 0) or None
+PGVECTOR_PROBES = int(os.getenv("PGVECTOR_PROBES") or 0) or None
+
+# Batch queries: answers synthesized at the same time, and queries per batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", 1000))
+
+# Retrieval-only results cached per query embedding, filters and top_k
+RETRIEVE_CACHE_SIZE = int(os.getenv("RETRIEVE_CACHE_SIZE", 1024))
+RETRIEVE_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVE_CACHE_TTL_SECONDS", 300))
+
+# Sampling profiles of a fraction of requests, or of requests whose X-Profile
+# header matches PROFILE_TOKEN. The rate can be changed at runtime through
+# POST /admin/profiling with the same token.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR") or ROOT_DIR / "logs" / "profiles")
+PROFILE_FORMAT = os.getenv("PROFILE_FORMAT", "speedscope")
+PROFILED_PATHS = ("/query", "/retrieve")
 
 # API Models
 class QueryRequest(BaseModel):
     query: str
+    # Only search chunks whose metadata matches, e.g. {"origin": "source"}.
+    # Fields are AND-ed, a list of values for a field is OR-ed.
+    filters: dict[str, str | list[str]] | None = None
+    # Conversation to continue, e.g. a Slack thread, so follow-up questions
+    # are answered with the earlier turns as context
+    session_id: str | None = None
 
 class QueryResponse(BaseModel):
     response: str
 
+class BatchQueryRequest(BaseModel):
+    queries: list[str] = Field(min_length=1)
+    filters: dict[str, str | list[str]] | None = None
+
+class RetrieveRequest(BaseModel):
+    query: str
+    filters: dict[str, str | list[str]] | None = None
+    top_k: int = Field(default=5, ge=1, le=100)
+
+class RetrievedNode(BaseModel):
+    id: str
+    text: str
+    score: float | None
+    metadata: dict
+
+class RetrieveResponse(BaseModel):
+    nodes: list[RetrievedNode]
+
+class ProfilingSettings(BaseModel):
+    sample_rate: float = Field(ge=0, le=1)
+
 # Global variables
 query_engine = None
+retriever = None
+response_synthesizer = None
+pgvector_pool = None
+startup_error = None
+
+async def summarize_turns(summary: str, turns: list[tuple[str, str]]) -> str:
+    """Folds the oldest turns of a conversation into its running summary."""
+    from llama_index.core import Settings
+
+    exchange = "\n".join(f"{role}: {content}" for role, content in turns)
+    response = await Settings.llm.acomplete(
+        "Update the summary of a conversation with the exchange below, "
+        "keeping the facts needed to answer follow-up questions, in under 100 words.\n\n"
+        f"Summary: {summary}\n{exchange}\n\nUpdated summary:"
+    )
+    return response.text.strip()
+
+def count_tokens(text: str) -> int:
+    """Counts tokens with the tokenizer LlamaIndex uses for prompts."""
+    from llama_index.core.utils import get_tokenizer
+
+    return len(get_tokenizer()(text))
+
+conversations = ConversationStore(
+    max_sessions=int(os.getenv("CONVERSATION_MAX_SESSIONS", 1000)),
+    ttl_seconds=float(os.getenv("CONVERSATION_TTL_SECONDS", 3600)),
+    token_budget=int(os.getenv("CONVERSATION_TOKEN_BUDGET", 1000)),
+    sqlite_path=os.getenv("CONVERSATION_DB") or None,
+    count_tokens=count_tokens,
+    summarize=summarize_turns,
+)
+
+# Identical queries in flight at the same time share one LLM call
+query_flights = SingleFlight()
+
+# Normalized query -> embedding, and (embedding, filters, top_k) -> nodes
+query_embeddings = LRUCache(max_size=RETRIEVE_CACHE_SIZE)
+retrieve_results = LRUCache(
+    max_size=RETRIEVE_CACHE_SIZE, ttl_seconds=RETRIEVE_CACHE_TTL_SECONDS
+)
+
+profiler = StageProfiler(PROFILE_DIR, output_format=PROFILE_FORMAT)
+profile_sample_rate = PROFILE_SAMPLE_RATE
+
+def is_profile_token(token: str | None) -> bool:
+    """Whether a token matches PROFILE_TOKEN, which must be set."""
+    return bool(PROFILE_TOKEN and token) and hmac.compare_digest(token, PROFILE_TOKEN)
 
-async def build_and_save_index():
+def build_and_save_index() -> "VectorStoreIndex":
     """Builds the index from PDF files and saves it."""
+    from llama_index.core import VectorStoreIndex
+    from llama_index.readers.file import PDFReader
+
     print("Loading PDF documents...")
     reader = PDFReader()
     pdf_files = list(DATA_DIR.glob("**/*.pdf"))
     
     documents = []
     for pdf_file in pdf_files:
-        documents.extend(reader.load_data(file=pdf_file))
+        # Partition metadata, the origin is the first folder under data/
+        rel_path = pdf_file.relative_to(DATA_DIR)
+        extra_info = {
+            "origin": rel_path.parts[0] if len(rel_path.parts) > 1 else DATA_DIR.name,
+            "collection": DATA_DIR.name,
+            "file_type": pdf_file.suffix,
+        }
+        documents.extend(reader.load_data(file=pdf_file, extra_info=extra_info))
     
     print(f"Loaded {len(documents)} document chunks from {len(pdf_files)} PDF files")
 
@@ -52,41 +184,151 @@ async def build_and_save_index():
     index.storage_context.persist(persist_dir=STORAGE_DIR)
     return index
 
-async def load_or_build_index():
+def load_or_build_index() -> "VectorStoreIndex":
     """Loads existing index or builds a new one if not found."""
+    from llama_index.core import StorageContext, load_index_from_storage
+
     if os.path.exists(STORAGE_DIR):
         print(f"Loading existing index from {STORAGE_DIR}/...")
         storage_context = StorageContext.from_defaults(persist_dir=STORAGE_DIR)
         index = load_index_from_storage(storage_context)
     else:
-        index = await build_and_save_index()
+        index = build_and_save_index()
     return index
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Handle startup and shutdown events for the FastAPI app."""
-    global query_engine
-    
-    # Startup: Setup global Settings and initialize query engine
-    Settings.embed_model = OpenAIEmbedding(api_key=os.getenv("OPENAI_API_KEY"))
+def load_or_build_vector_index(index: "VectorStoreIndex") -> "PartitionedIndex":
+    """Loads the partitioned copy of the index embeddings, building it if needed."""
+    from partitioned_index import PARTITION_FIELDS, PartitionedIndex
+    from quantized_index import QuantizedIndex
+
+    path = VECTORS_DIR / VECTOR_QUANTIZATION
+    if not (path / "index.json").exists():
+        print(f"Building {VECTOR_QUANTIZATION} vector index in {path}/...")
+        vectors = QuantizedIndex.from_embeddings(
+            index.vector_store.data.embedding_dict,
+            quantization=VECTOR_QUANTIZATION,
+        )
+        metadata = [index.docstore.get_node(node_id).metadata for node_id in vectors.ids]
+        PartitionedIndex.from_metadata(vectors, metadata, PARTITION_FIELDS).save(path)
+    return PartitionedIndex.load(path, rescore_factor=RESCORE_FACTOR)
+
+def load_settings():
+    """Sets up the global LlamaIndex embedding model and LLM."""
+    from llama_index.core import Settings
+    from llama_index.llms.openai import OpenAI
+
+    from local_embeddings import get_embed_model
+
+    Settings.embed_model = get_embed_model()
     Settings.llm = OpenAI(
         api_key=os.getenv("OPENAI_API_KEY"),
         model="gpt-4o-mini"
     )
-    
-    # Load or build the index
-    index = await load_or_build_index()
-    
-    # Create a query engine
-    query_engine = index.as_query_engine()
-    
-    print("🔵 Chatbot API is ready to accept queries!")
-    
+
+def check_dimensions(dimensions: int, source: str):
+    """Fails unless the embed model's vectors have the dimensions of the source's."""
+    from llama_index.core import Settings
+
+    # Queries embedded by another model than the vectors can't be compared
+    model_dimensions = len(Settings.embed_model.get_query_embedding("dimensions"))
+    if model_dimensions != dimensions:
+        raise ValueError(
+            f"The embed model has {model_dimensions} dimensions but {source} has "
+            f"{dimensions}, set EMBED_BACKEND and EMBED_MODEL to the model it was "
+            "built with"
+        )
+
+def load_local_retriever():
+    """Loads the index in storage/ and a retriever over its partitioned vectors."""
+    from llama_index.core import Settings
+
+    from retrievers import PartitionedRetriever
+
+    index = load_or_build_index()
+    vector_index = load_or_build_vector_index(index)
+    check_dimensions(vector_index.index.vectors.shape[1], f"the index in {STORAGE_DIR}")
+    return PartitionedRetriever(
+        vector_index,
+        docstore=index.docstore,
+        embed_model=Settings.embed_model,
+    )
+
+async def connect_pgvector_retriever() -> "PGVectorRetriever":
+    """Opens the connection pool and connects a retriever to the collection."""
+    global pgvector_pool
+    from llama_index.core import Settings
+    from psycopg.conninfo import make_conninfo
+    from psycopg_pool import AsyncConnectionPool
+
+    from retrievers import PGVectorRetriever
+
+    conninfo = make_conninfo(
+        host=os.getenv("PGVECTOR_URI", "localhost"),
+        port=os.getenv("PGVECTOR_PORT", "5432"),
+        dbname=os.getenv("PGVECTOR_DATABASE_NAME"),
+        user=os.getenv("PGVECTOR_USER"),
+        password=os.getenv("PGVECTOR_PASS"),
+    )
+    pgvector_pool = AsyncConnectionPool(
+        conninfo, min_size=1, max_size=PGVECTOR_POOL_SIZE, open=False
+    )
+    await pgvector_pool.open()
+    pg_retriever = await PGVectorRetriever.from_collection(
+        pgvector_pool,
+        PGVECTOR_COLLECTION,
+        embed_model=Settings.embed_model,
+        ef_search=PGVECTOR_EF_SEARCH,
+        probes=PGVECTOR_PROBES,
+    )
+    await asyncio.to_thread(
+        check_dimensions, pg_retriever.dimensions, f"collection {PGVECTOR_COLLECTION}"
+    )
+    return pg_retriever
+
+async def initialize():
+    """Imports LlamaIndex, loads the models and the index, and creates the query engine."""
+    global query_engine, retriever, response_synthesizer, startup_error
+    try:
+        # Imports and index loading block, so they run off the event loop
+        await asyncio.to_thread(load_settings)
+
+        # Create a query engine
+        if VECTOR_BACKEND == "pgvector":
+            retriever = await connect_pgvector_retriever()
+        else:
+            retriever = await asyncio.to_thread(load_local_retriever)
+
+        from llama_index.core import get_response_synthesizer
+        from llama_index.core.query_engine import RetrieverQueryEngine
+
+        response_synthesizer = get_response_synthesizer()
+        query_engine = RetrieverQueryEngine(
+            retriever=retriever, response_synthesizer=response_synthesizer
+        )
+        print("🔵 Chatbot API is ready to accept queries!")
+    except Exception as e:
+        startup_error = str(e)
+        print(f"❌ Chatbot API failed to start: {startup_error}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Handle startup and shutdown events for the FastAPI app."""
+    global query_engine, retriever, response_synthesizer
+
+    # Startup: initialize the query engine in the background, requests get a
+    # 503 until it is ready
+    init_task = asyncio.create_task(initialize())
+
     yield  # Application runs here
-    
+
     # Shutdown: Optional cleanup (e.g., clear query_engine)
     print("🛑 Shutting down Chatbot API...")
+    init_task.cancel()
     query_engine = None
+    retriever = None
+    response_synthesizer = None
+    if pgvector_pool is not None:
+        await pgvector_pool.close()
 
 # Initialize FastAPI app with lifespan
 app = FastAPI(
@@ -96,23 +338,206 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+class ProfileRequests:
+    """
+    Profile sampled or explicitly requested queries.
+
+    A plain ASGI middleware, as the request and response wrapping of
+    `@app.middleware("http")` would slow down every request, profiled or not.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def should_profile(self, scope) -> bool:
+        if scope["type"] != "http" or scope["path"] not in PROFILED_PATHS:
+            return False
+        if not profiler.enabled:
+            return False
+        if profile_sample_rate and random.random() < profile_sample_rate:
+            return True
+        return bool(PROFILE_TOKEN) and is_profile_token(
+            Headers(scope=scope).get("X-Profile")
+        )
+
+    async def __call__(self, scope, receive, send):
+        if self.should_profile(scope):
+            with profiler.stage(scope["path"].strip("/")):
+                await self.app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+app.add_middleware(ProfileRequests)
+
+@app.post("/admin/profiling")
+async def set_profiling(
+    settings: ProfilingSettings, x_admin_token: str | None = Header(default=None)
+):
+    """Change the fraction of requests that are profiled"""
+    global profile_sample_rate
+    if not is_profile_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    profile_sample_rate = settings.sample_rate
+    return {"sample_rate": profile_sample_rate, "profile_dir": str(PROFILE_DIR)}
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy"}
+    """Health check endpoint, also reporting whether the query engine is ready"""
+    if startup_error is not None:
+        return JSONResponse(
+            status_code=503, content={"status": "failed", "error": startup_error}
+        )
+    return {"status": "healthy", "ready": query_engine is not None}
+
+@app.get("/stats")
+async def stats():
+    """Conversation memory, prompt size and query coalescing statistics"""
+    return {
+        "conversations": conversations.stats(),
+        "queries": query_flights.stats(),
+        "query_embeddings": query_embeddings.stats(),
+        "retrieve_results": retrieve_results.stats(),
+    }
 
 @app.post("/query", response_model=QueryResponse)
 async def query_chatbot(request: QueryRequest):
     """Send a query to the chatbot and get a response"""
     if query_engine is None:
         raise HTTPException(status_code=503, detail="Query engine not initialized")
-    
+    from llama_index.core.query_engine import RetrieverQueryEngine
+    from llama_index.core.schema import QueryBundle
+
+    engine = query_engine
+    if request.filters:
+        try:
+            engine = RetrieverQueryEngine(
+                retriever=retriever.filtered(request.filters),
+                response_synthesizer=response_synthesizer,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    query = request.query
+    session = conversations.get(request.session_id) if request.session_id else None
+    if session is not None:
+        # Synthesize with the conversation history, but retrieve with the
+        # question alone, prefixed by the previous one for follow-ups
+        last_question = next(
+            (content for role, content in reversed(session.turns) if role == "User"), ""
+        )
+        query = QueryBundle(
+            query_str=conversations.prompt(session, request.query),
+            custom_embedding_strs=[f"{last_question} {request.query}".strip()],
+        )
+
     try:
-        response = await query_engine.aquery(request.query)
+        if session is not None:
+            response = await engine.aquery(query)
+            await conversations.add_turn(session, request.query, str(response))
+        else:
+            # Answers in a conversation depend on its history, other queries
+            # are shared by identical query, up to whitespace, and filters
+            key = (
+                normalize_query(request.query),
+                json.dumps(request.filters, sort_keys=True),
+            )
+            response = await query_flights.do(key, lambda: engine.aquery(query))
         return QueryResponse(response=str(response))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
+@app.post("/retrieve", response_model=RetrieveResponse)
+async def retrieve(request: RetrieveRequest):
+    """Get the top-k matching chunks of a query without synthesizing an answer"""
+    if retriever is None:
+        raise HTTPException(status_code=503, detail="Query engine not initialized")
+
+    query_retriever = retriever
+    if request.filters:
+        try:
+            query_retriever = retriever.filtered(request.filters)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    from llama_index.core import Settings
+
+    # The query is embedded as sent, queries differing only in whitespace,
+    # which the tokenizers ignore, share a cache entry
+    normalized = normalize_query(request.query)
+    embedding = query_embeddings.get(normalized)
+    if embedding is None:
+        embedding = await Settings.embed_model.aget_query_embedding(request.query)
+        query_embeddings.put(normalized, embedding)
+
+    key = (
+        tuple(embedding),
+        json.dumps(request.filters, sort_keys=True),
+        request.top_k,
+    )
+    nodes = retrieve_results.get(key)
+    if nodes is None:
+        nodes = [
+            RetrievedNode(
+                id=result.node.node_id,
+                text=result.node.get_content(),
+                score=result.score,
+                metadata=result.node.metadata,
+            )
+            for result in await query_retriever.asearch(embedding, k=request.top_k)
+        ]
+        retrieve_results.put(key, nodes)
+    return RetrieveResponse(nodes=nodes)
+
+@app.post("/query/batch")
+async def query_batch(request: BatchQueryRequest):
+    """Answer many queries, streaming an NDJSON line per answer as it finishes"""
+    if query_engine is None:
+        raise HTTPException(status_code=503, detail="Query engine not initialized")
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {BATCH_MAX_QUERIES} queries per batch",
+        )
+
+    batch_retriever = retriever
+    if request.filters:
+        try:
+            batch_retriever = retriever.filtered(request.filters)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def answer(index: int, query: str, nodes) -> dict:
+        async with semaphore:
+            try:
+                response = await response_synthesizer.asynthesize(query, nodes)
+                return {"index": index, "query": query, "response": str(response)}
+            except Exception as e:
+                return {"index": index, "query": query, "error": str(e)}
+
+    async def results():
+        # Query embeddings and one vector search for the whole batch, then
+        # synthesis with bounded concurrency
+        try:
+            batch_nodes = await batch_retriever.aretrieve_batch(request.queries)
+        except Exception as e:
+            yield json.dumps({"error": f"Error retrieving: {str(e)}"}) + "\n"
+            return
+        tasks = [
+            asyncio.create_task(answer(index, query, nodes))
+            for index, (query, nodes) in enumerate(zip(request.queries, batch_nodes))
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield json.dumps(await task) + "\n"
+        finally:
+            # Stop synthesizing if the client goes away
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
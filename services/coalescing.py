@@ -0,0 +1,81 @@
+"""Coalescing of duplicate requests."""
+
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+_SPACES_PATTERN = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Collapse whitespace so queries differing only in spacing match.
+
+    Case is kept, as the embedding and the answer of a query can depend on it.
+    """
+    return _SPACES_PATTERN.sub(" ", query).strip()
+
+
+class SingleFlight:
+    """
+    Share one in-flight computation between concurrent calls with the same key.
+
+    The first call for a key starts the computation and every call for that
+    key made before it finishes awaits the same result. The computation runs
+    as its own task, so a caller going away doesn't cancel it for the others.
+    """
+
+    def __init__(self):
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._tasks),
+        }
+
+
+class RecentRequests:
+    """Thread-safe record of request ids seen within the last `ttl_seconds`."""
+
+    def __init__(self, ttl_seconds: float = 600, max_size: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._seen: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def seen(self, request_id: str) -> bool:
+        """Record a request id, returning whether it was already seen."""
+        now = time.time()
+        with self._lock:
+            while self._seen and (
+                now - next(iter(self._seen.values())) > self.ttl_seconds
+            ):
+                self._seen.popitem(last=False)
+            if request_id in self._seen:
+                self.duplicates += 1
+                return True
+            # Only make room once the id is known to be new, so a full record
+            # doesn't evict the very id being checked
+            while len(self._seen) >= self.max_size:
+                self._seen.popitem(last=False)
+            self._seen[request_id] = now
+            return False
@@ -0,0 +1,183 @@
+"""Bounded per-session conversation memory."""
+
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Session:
+    """Conversation state of a single session, e.g. a Slack thread."""
+
+    summary: str = ""
+    turns: list[tuple[str, str]] = field(default_factory=list)
+    updated: float = field(default_factory=time.time)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the session's text."""
+        return sys.getsizeof(self.summary) + sum(
+            sys.getsizeof(role) + sys.getsizeof(content) for role, content in self.turns
+        )
+
+
+def _approximate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+class ConversationStore:
+    """
+    In-memory conversation history per session with LRU and TTL eviction.
+
+    Sessions idle for longer than `ttl_seconds` expire. Beyond `max_sessions`
+    the least recently used session is evicted, or spilled to SQLite when
+    `sqlite_path` is set and loaded back on its next turn. Once the history
+    of a session exceeds `token_budget`, its oldest turns are folded into a
+    running summary so the prompt stays within a fixed size.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        ttl_seconds: float = 3600,
+        token_budget: int = 1000,
+        keep_turns: int = 4,
+        sqlite_path: str | None = None,
+        count_tokens: Callable[[str], int] = _approximate_tokens,
+        summarize: Callable[[str, list[tuple[str, str]]], Awaitable[str]] | None = None,
+    ):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.count_tokens = count_tokens
+        self.summarize = summarize
+        self.sessions: OrderedDict[str, Session] = OrderedDict()
+        self.prompt_tokens: list[int] = []
+        self._lock = threading.Lock()
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def _expired(self, session: Session) -> bool:
+        return time.time() - session.updated > self.ttl_seconds
+
+    def _spill(self, session_id: str, session: Session):
+        if self._db is None:
+            return
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (session_id, json.dumps(asdict(session)), session.updated),
+            )
+            # Sessions that expired while spilled are never loaded back
+            self._db.execute(
+                "DELETE FROM sessions WHERE updated < ?",
+                (time.time() - self.ttl_seconds,),
+            )
+
+    def _unspill(self, session_id: str) -> Session | None:
+        if self._db is None:
+            return None
+        with self._db:
+            row = self._db.execute(
+                "SELECT data FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        data = json.loads(row[0])
+        data["turns"] = [tuple(turn) for turn in data["turns"]]
+        return Session(**data)
+
+    def get(self, session_id: str) -> Session:
+        """Get a session, creating it if it doesn't exist or has expired."""
+        with self._lock:
+            session = self.sessions.pop(session_id, None) or self._unspill(session_id)
+            if session is None or self._expired(session):
+                session = Session()
+            self.sessions[session_id] = session
+            # Evict expired sessions, then the least recently used ones
+            while self.sessions:
+                oldest_id, oldest = next(iter(self.sessions.items()))
+                if self._expired(oldest):
+                    del self.sessions[oldest_id]
+                elif len(self.sessions) > self.max_sessions:
+                    del self.sessions[oldest_id]
+                    self._spill(oldest_id, oldest)
+                else:
+                    break
+            return session
+
+    def history(self, session: Session) -> str:
+        """The summary and recent turns of a session, as prompt text."""
+        lines = []
+        if session.summary:
+            lines.append(f"Summary of the earlier conversation: {session.summary}")
+        lines.extend(f"{role}: {content}" for role, content in session.turns)
+        return "\n".join(lines)
+
+    def prompt(self, session: Session, query: str) -> str:
+        """Build the prompt for the next question of a session."""
+        history = self.history(session)
+        if not history:
+            prompt = query
+        else:
+            prompt = (
+                f"Conversation so far:\n{history}\n\n"
+                f"Answer the follow-up question using the conversation as context.\n"
+                f"Question: {query}"
+            )
+        self.prompt_tokens.append(self.count_tokens(prompt))
+        del self.prompt_tokens[:-1000]
+        return prompt
+
+    async def add_turn(self, session: Session, question: str, answer: str):
+        """Record a question and its answer, summarizing old turns if needed."""
+        session.turns.extend([("User", question), ("Assistant", answer)])
+        session.updated = time.time()
+        while (
+            len(session.turns) > self.keep_turns
+            and self.count_tokens(self.history(session)) > self.token_budget
+        ):
+            # Fold the oldest question and answer into the summary
+            oldest, session.turns = session.turns[:2], session.turns[2:]
+            if self.summarize is not None:
+                # The answer is already computed, so a failed summary falls
+                # back to truncating rather than failing the query
+                try:
+                    session.summary = await self.summarize(session.summary, oldest)
+                    continue
+                except Exception as e:
+                    logger.warning(f"Summarizing the conversation failed: {e}")
+            session.summary = " ".join(
+                [session.summary] + [content for _, content in oldest]
+            )[-self.token_budget * 2 :]
+
+    def stats(self) -> dict[str, float]:
+        """Memory held by active sessions and prompt tokens per turn."""
+        with self._lock:
+            sizes = [session.nbytes for session in self.sessions.values()]
+        return {
+            "active_sessions": len(sizes),
+            "memory_bytes": sum(sizes),
+            "avg_bytes_per_session": sum(sizes) / len(sizes) if sizes else 0,
+            "avg_prompt_tokens": (
+                sum(self.prompt_tokens) / len(self.prompt_tokens)
+                if self.prompt_tokens
+                else 0
+            ),
+            "max_prompt_tokens": max(self.prompt_tokens, default=0),
+        }
@@ -0,0 +1,77 @@
+"""Local ONNX Runtime embeddings for LlamaIndex."""
+
+import asyncio
+import os
+from typing import Any
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from onnx_embeddings import OnnxEmbeddingModel
+from pydantic import PrivateAttr
+
+EMBED_BACKENDS = ["openai", "onnx", "onnx-int8"]
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """LlamaIndex embedding model running a sentence-transformers model on CPU."""
+
+    _model: OnnxEmbeddingModel = PrivateAttr()
+
+    def __init__(
+        self,
+        model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+        quantize: bool = False,
+        threads: int | None = None,
+        **kwargs: Any,
+    ):
+        super().__init__(model_name=model_name, **kwargs)
+        self._model = OnnxEmbeddingModel(
+            model_name=model_name,
+            quantize=quantize,
+            batch_size=self.embed_batch_size,
+            threads=threads,
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return self._model.embed([query])[0].tolist()
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self._model.embed([text])[0].tolist()
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        return self._model.embed(texts).tolist()
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        # Inference releases the GIL, so run it off the event loop
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    async def _aget_text_embedding(self, text: str) -> list[float]:
+        return await asyncio.to_thread(self._get_text_embedding, text)
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        # One batched inference call instead of one call per text
+        return await asyncio.to_thread(self._get_text_embeddings, texts)
+
+    async def aget_query_embedding_batch(self, queries: list[str]) -> list[list[float]]:
+        """Embed many queries with one batched inference call."""
+        return await asyncio.to_thread(lambda: self._model.embed(queries).tolist())
+
+
+def get_embed_model(backend: str | None = None) -> BaseEmbedding:
+    """Create the embedding model selected by the EMBED_* environment variables."""
+    backend = backend or os.getenv("EMBED_BACKEND", "openai")
+    if backend == "openai":
+        from llama_index.embeddings.openai import OpenAIEmbedding
+
+        return OpenAIEmbedding(api_key=os.getenv("OPENAI_API_KEY"))
+    if backend in ("onnx", "onnx-int8"):
+        threads = os.getenv("EMBED_THREADS")
+        return OnnxEmbedding(
+            model_name=os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+            quantize=backend == "onnx-int8",
+            threads=int(threads) if threads else None,
+        )
+    raise ValueError(f"Unknown embedding backend {backend}, expected one of {EMBED_BACKENDS}")
@@ -0,0 +1,322 @@
+"""Retrievers used by the agent service."""
+
+import asyncio
+import copy
+import logging
+
+import numpy as np
+import psycopg
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+from llama_index.core.storage.docstore.types import BaseDocumentStore
+from psycopg_pool import AsyncConnectionPool
+
+from partitioned_index import PARTITION_FIELDS, PartitionedIndex
+from pgvector_index import (
+    COLLECTION_ID_QUERY,
+    DIMENSIONS_QUERY,
+    get_collection_id,
+    get_dimensions,
+    search_query,
+    search_settings,
+    to_pgvector,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def aembed_queries(
+    embed_model: BaseEmbedding, query_strs: list[str], concurrency: int = 16
+) -> list[list[float]]:
+    """
+    Embed queries as queries rather than documents, as single queries are.
+
+    Models that can embed a batch of queries at once do so, OpenAI models in
+    requests of `embed_batch_size` queries sent to their query engine. Others
+    are called concurrently, once per query.
+    """
+    if hasattr(embed_model, "aget_query_embedding_batch"):
+        return await embed_model.aget_query_embedding_batch(query_strs)
+    if hasattr(embed_model, "_query_engine"):
+        from llama_index.embeddings.openai.base import aget_embeddings
+
+        aclient = embed_model._get_aclient()
+        batch_size = embed_model.embed_batch_size
+        batches = await asyncio.gather(
+            *(
+                aget_embeddings(
+                    aclient,
+                    query_strs[i:i + batch_size],
+                    engine=embed_model._query_engine,
+                    **embed_model.additional_kwargs,
+                )
+                for i in range(0, len(query_strs), batch_size)
+            )
+        )
+        return [embedding for batch in batches for embedding in batch]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def embed(query_str: str) -> list[float]:
+        async with semaphore:
+            return await embed_model.aget_query_embedding(query_str)
+
+    return list(await asyncio.gather(*map(embed, query_strs)))
+
+
+class PartitionedRetriever(BaseRetriever):
+    """Retrieve nodes from a `PartitionedIndex` built over the index embeddings."""
+
+    def __init__(
+        self,
+        index: PartitionedIndex,
+        docstore: BaseDocumentStore,
+        embed_model: BaseEmbedding,
+        similarity_top_k: int = 2,
+        filters: dict[str, str | list[str]] | None = None,
+        **kwargs,
+    ):
+        self._index = index
+        self._docstore = docstore
+        self._embed_model = embed_model
+        self._similarity_top_k = similarity_top_k
+        self._filters = filters
+        super().__init__(**kwargs)
+
+    def filtered(
+        self, filters: dict[str, str | list[str]] | None
+    ) -> "PartitionedRetriever":
+        """A copy of this retriever restricted to the partitions matching `filters`."""
+        # Fail early on unknown fields
+        self._index.rows_for(filters)
+        retriever = copy.copy(self)
+        retriever._filters = filters
+        return retriever
+
+    def _to_nodes(self, results: list[tuple[str, float]]) -> list[NodeWithScore]:
+        return [
+            NodeWithScore(node=self._docstore.get_node(node_id), score=score)
+            for node_id, score in results
+        ]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        # Embed the custom embedding string when set, e.g. a follow-up question
+        # without the conversation history of the synthesis prompt
+        embedding = query_bundle.embedding or self._embed_model.get_query_embedding(
+            query_bundle.embedding_strs[0]
+        )
+        results = self._index.search(
+            np.array(embedding), k=self._similarity_top_k, filters=self._filters
+        )
+        return self._to_nodes(results[0])
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        embedding = query_bundle.embedding or await self._embed_model.aget_query_embedding(
+            query_bundle.embedding_strs[0]
+        )
+        return await self.asearch(embedding)
+
+    async def asearch(
+        self, embedding: list[float], k: int | None = None
+    ) -> list[NodeWithScore]:
+        """Retrieve the k nearest nodes of an already computed query embedding."""
+        results = await asyncio.to_thread(
+            self._index.search,
+            np.array(embedding),
+            k or self._similarity_top_k,
+            self._filters,
+        )
+        return self._to_nodes(results[0])
+
+    async def aretrieve_batch(self, query_strs: list[str]) -> list[list[NodeWithScore]]:
+        """Retrieve for many queries with batched embeddings and one search."""
+        embeddings = await aembed_queries(self._embed_model, query_strs)
+        results = await asyncio.to_thread(
+            self._index.search,
+            np.array(embeddings),
+            self._similarity_top_k,
+            self._filters,
+        )
+        return [self._to_nodes(found) for found in results]
+
+
+class PGVectorRetriever(BaseRetriever):
+    """
+    Retrieve nodes from a PGVector collection written by the ingest pipeline.
+
+    Async queries run on a shared async connection pool, use the collection's
+    ANN index, and filter on the chunk metadata. Synchronous queries, which the
+    service doesn't make, open a connection of their own. The embed model must
+    be the one the collection was ingested with.
+
+    Overwriting a collection re-creates it under a new id, so when a search
+    finds nothing the id is looked up again by name and the search retried.
+    """
+
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        collection_name: str,
+        collection_id: str,
+        dimensions: int,
+        embed_model: BaseEmbedding,
+        similarity_top_k: int = 2,
+        filters: dict[str, str | list[str]] | None = None,
+        ef_search: int | None = None,
+        probes: int | None = None,
+        **kwargs,
+    ):
+        self._pool = pool
+        self._collection_name = collection_name
+        # Shared with the filtered copies, so they all follow a re-created
+        # collection
+        self._collection = {"id": collection_id, "dimensions": dimensions}
+        self._embed_model = embed_model
+        self._similarity_top_k = similarity_top_k
+        self._filters = filters
+        self._settings = search_settings(ef_search=ef_search, probes=probes)
+        self._query = None
+        self._query_collection_id = None
+        super().__init__(**kwargs)
+
+    @staticmethod
+    async def _alookup(conn, collection_name: str) -> tuple[str, int | None] | None:
+        """The id and dimensions of a collection, None if it doesn't exist."""
+        cursor = await conn.execute(COLLECTION_ID_QUERY, (collection_name,))
+        row = await cursor.fetchone()
+        if row is None:
+            return None
+        collection_id = str(row[0])
+        cursor = await conn.execute(DIMENSIONS_QUERY, (collection_id,))
+        row = await cursor.fetchone()
+        return collection_id, None if row is None else row[0]
+
+    @classmethod
+    async def from_collection(
+        cls, pool: AsyncConnectionPool, collection_name: str, **kwargs
+    ) -> "PGVectorRetriever":
+        """Create a retriever for a collection, looked up by name."""
+        async with pool.connection() as conn:
+            found = await cls._alookup(conn, collection_name)
+        if found is None:
+            raise ValueError(f"Collection {collection_name} does not exist")
+        collection_id, dimensions = found
+        if dimensions is None:
+            raise ValueError(f"Collection {collection_name} is empty")
+        return cls(pool, collection_name, collection_id, dimensions, **kwargs)
+
+    @property
+    def dimensions(self) -> int:
+        return self._collection["dimensions"]
+
+    def filtered(
+        self, filters: dict[str, str | list[str]] | None
+    ) -> "PGVectorRetriever":
+        """A copy of this retriever restricted to the chunks matching `filters`."""
+        unknown = set(filters or {}) - set(PARTITION_FIELDS)
+        if unknown:
+            raise ValueError(
+                f"Unknown filter fields {sorted(unknown)}, expected {PARTITION_FIELDS}"
+            )
+        retriever = copy.copy(self)
+        retriever._filters = filters
+        retriever._query = retriever._query_collection_id = None
+        return retriever
+
+    def _current_query(self):
+        """The search query of the current collection id, built once per id."""
+        collection_id = self._collection["id"]
+        if self._query_collection_id != collection_id:
+            self._query = search_query(collection_id, self.dimensions, self._filters)
+            self._query_collection_id = collection_id
+        return self._query
+
+    def _update_collection(self, found: tuple[str, int | None] | None) -> bool:
+        """Switch to a re-created collection, returning whether its id changed."""
+        if found is None or found[0] == self._collection["id"]:
+            return False
+        collection_id, dimensions = found
+        logger.info(
+            f"Collection {self._collection_name} was re-created, "
+            f"now searching {collection_id}"
+        )
+        self._collection.update(
+            id=collection_id, dimensions=dimensions or self.dimensions
+        )
+        return True
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        embedding = query_bundle.embedding or self._embed_model.get_query_embedding(
+            query_bundle.embedding_strs[0]
+        )
+        return self.search(embedding)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        embedding = query_bundle.embedding or await self._embed_model.aget_query_embedding(
+            query_bundle.embedding_strs[0]
+        )
+        return await self.asearch(embedding)
+
+    async def aretrieve_batch(self, query_strs: list[str]) -> list[list[NodeWithScore]]:
+        """Retrieve for many queries with batched embeddings, searching concurrently."""
+        embeddings = await aembed_queries(self._embed_model, query_strs)
+        return list(await asyncio.gather(*map(self.asearch, embeddings)))
+
+    def _params(self, embedding: list[float], k: int | None) -> dict:
+        return {"embedding": to_pgvector(embedding), "k": k or self._similarity_top_k}
+
+    @staticmethod
+    def _to_nodes(rows: list[tuple]) -> list[NodeWithScore]:
+        return [
+            NodeWithScore(
+                node=TextNode(id_=str(node_id), text=document, metadata=metadata or {}),
+                score=float(score),
+            )
+            for node_id, document, metadata, score in rows
+        ]
+
+    def search(
+        self, embedding: list[float], k: int | None = None
+    ) -> list[NodeWithScore]:
+        """Synchronous `asearch`, on a connection opened for the query."""
+        with psycopg.connect(self._pool.conninfo) as conn:
+            for attempt in range(2):
+                with conn.transaction():
+                    for setting in self._settings:
+                        conn.execute(setting)
+                    rows = conn.execute(
+                        self._current_query(), self._params(embedding, k)
+                    ).fetchall()
+                if rows or attempt:
+                    break
+                try:
+                    collection_id = get_collection_id(conn, self._collection_name)
+                except ValueError:
+                    break
+                found = (collection_id, get_dimensions(conn, collection_id))
+                if not self._update_collection(found):
+                    break
+        return self._to_nodes(rows)
+
+    async def asearch(
+        self, embedding: list[float], k: int | None = None
+    ) -> list[NodeWithScore]:
+        """Retrieve the k nearest nodes of an already computed query embedding."""
+        async with self._pool.connection() as conn:
+            for attempt in range(2):
+                # SET LOCAL only lasts for the transaction, so pooled
+                # connections keep their defaults
+                async with conn.transaction():
+                    for setting in self._settings:
+                        await conn.execute(setting)
+                    cursor = await conn.execute(
+                        self._current_query(), self._params(embedding, k)
+                    )
+                    rows = await cursor.fetchall()
+                # Nothing found may mean the collection was overwritten
+                if rows or attempt:
+                    break
+                found = await self._alookup(conn, self._collection_name)
+                if not self._update_collection(found):
+                    break
+        return self._to_nodes(rows)
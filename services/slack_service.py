@@ -1,8 +1,12 @@
 from flask import Flask, request, jsonify
 import os
+import re
+import threading
 import slack_sdk
 from slack_sdk.web import WebClient
 from slack_sdk.signature import SignatureVerifier
+
+from coalescing import RecentRequests
 # from rag_model import get_rag_response
 
 from dotenv import load_dotenv
@@ -18,22 +22,31 @@ signing_secret = "165bb0d941425645b37d1ff7a6d77f30"
 client = WebClient(token=slack_token)
 verifier = SignatureVerifier(signing_secret)
 
+# Slack retries events it didn't see acknowledged in time, with the same event_id
+recent_events = RecentRequests(ttl_seconds=3600)
+
+# User mentions such as "<@U123ABC>", an app_mention's text starts with the bot's
+MENTION_PATTERN = re.compile(r"<@[UW][A-Z0-9]+(\|[^>]*)?>")
+
 
-def get_rag_response(query: str) -> str:
+def get_rag_response(query: str, session_id: str | None = None) -> str:
     """
     Query the agent service and get response
+
+    Queries with the same session_id (e.g. a Slack thread) are answered as a
+    conversation, so follow-up questions don't need to repeat context.
     """
     import requests
     import json
 
     # Configure the endpoint URL - adjust host/port as needed
-    agent_service_url = f"{os.getenv("AGENT_SERVICE_URL")}/query"
+    agent_service_url = f"{os.getenv('AGENT_SERVICE_URL')}/query"
 
     try:
         # Make POST request to the agent service
         response = requests.post(
             agent_service_url,
-            json={"query": query},
+            json={"query": query, "session_id": session_id},
             headers={"Content-Type": "application/json"}
         )
 
@@ -78,6 +91,7 @@ def slack_prompt():
     # Change this to your RAG model's response function
     # This is where you would call your RAG model
     # For example, if you have a function `get_rag_response`:
+    # Slash commands have no thread, so each one is a standalone question
     response = get_rag_response(query)
 
     # Respond back publicly in the slack channel or privately to the user
@@ -87,5 +101,49 @@ def slack_prompt():
     })
 
 
+@app.route("/slack/stats", methods=["GET"])
+def slack_stats():
+    return jsonify({"duplicate_events": recent_events.duplicates})
+
+
+def answer_in_thread(event: dict):
+    """Answer a message in its thread, continuing the thread's conversation."""
+    channel = event["channel"]
+    thread_ts = event.get("thread_ts") or event["ts"]
+    session_id = f"{channel}:{thread_ts}"
+    query = MENTION_PATTERN.sub("", event.get("text", "")).strip()
+    response = get_rag_response(query, session_id=session_id)
+    client.chat_postMessage(channel=channel, thread_ts=thread_ts, text=response)
+
+
+@app.route("/slack/events", methods=["POST"])
+def slack_events():
+    if not verifier.is_valid_request(request.get_data(), request.headers):
+        return "Invalid request signature", 403
+    data = request.get_json()
+    if data.get("type") == "url_verification":
+        return jsonify({"challenge": data.get("challenge")})
+
+    # Drop retries of events already being answered
+    event_id = data.get("event_id")
+    if event_id and recent_events.seen(event_id):
+        retry_num = request.headers.get("X-Slack-Retry-Num")
+        app.logger.info(f"Ignoring retry {retry_num} of event {event_id}")
+        return "", 200
+
+    event = data.get("event", {})
+    # Answer mentions and direct messages; skip bot messages, including our
+    # own answers
+    is_direct_message = (
+        event.get("type") == "message" and event.get("channel_type") == "im"
+    )
+    if (event.get("type") == "app_mention" or is_direct_message) and not (
+        event.get("bot_id") or event.get("subtype")
+    ):
+        # Slack expects an acknowledgement within 3 seconds
+        threading.Thread(target=answer_in_thread, args=(event,), daemon=True).start()
+    return "", 200
+
+
 if __name__ == "__main__":
     app.run(debug=True,port=3000)
@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+# The vector_store modules use flat imports, as they are run as scripts, and so
+# do the services
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT_DIR / "vector_store"))
+sys.path.append(str(ROOT_DIR / "services"))
@@ -0,0 +1,24 @@
+from caching import LRUCache
+
+
+def test_ttl_expiry(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("caching.time.time", lambda: now)
+    cache = LRUCache(ttl_seconds=60)
+    cache.put("query", [0.1, 0.2])
+    now += 60
+    assert cache.get("query") == [0.1, 0.2]
+    now += 1
+    assert cache.get("query") is None
+    assert cache.stats() == {"size": 0, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_least_recently_used_is_evicted():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
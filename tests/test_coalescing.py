@@ -0,0 +1,71 @@
+import asyncio
+
+from coalescing import RecentRequests, SingleFlight, normalize_query
+
+
+def test_normalize_query_only_collapses_whitespace():
+    query = "  What is\n the  Leave policy? "
+    assert normalize_query(query) == "What is the Leave policy?"
+
+
+def test_single_flight_shares_one_task():
+    flights = SingleFlight()
+    calls = 0
+
+    async def answer():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "20 days"
+
+    async def main():
+        results = await asyncio.gather(
+            *(flights.do("leave", answer) for _ in range(5))
+        )
+        # Finished keys are computed again
+        results.append(await flights.do("leave", answer))
+        return results
+
+    assert asyncio.run(main()) == ["20 days"] * 6
+    assert calls == 2
+    assert flights.stats() == {"calls": 2, "coalesced": 4, "in_flight": 0}
+
+
+def test_single_flight_survives_a_cancelled_caller():
+    flights = SingleFlight()
+
+    async def answer():
+        await asyncio.sleep(0.01)
+        return "20 days"
+
+    async def main():
+        first = asyncio.ensure_future(flights.do("leave", answer))
+        second = asyncio.ensure_future(flights.do("leave", answer))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "20 days"
+
+
+def test_recent_requests_ttl_eviction(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("coalescing.time.time", lambda: now)
+    recent = RecentRequests(ttl_seconds=10)
+    assert not recent.seen("event-1")
+    assert recent.seen("event-1")
+    now += 5
+    assert not recent.seen("event-2")
+    now += 6
+    # event-1 is now older than the TTL, event-2 isn't
+    assert not recent.seen("event-1")
+    assert recent.seen("event-2")
+    assert recent.duplicates == 2
+
+
+def test_recent_requests_max_size():
+    recent = RecentRequests(max_size=2)
+    for request_id in ("a", "b", "c"):
+        assert not recent.seen(request_id)
+    assert not recent.seen("a")
+    assert recent.seen("c")
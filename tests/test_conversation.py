@@ -0,0 +1,77 @@
+import asyncio
+
+from conversation import ConversationStore
+
+
+def test_least_recently_used_session_is_spilled(tmp_path):
+    store = ConversationStore(
+        max_sessions=2, sqlite_path=str(tmp_path / "sessions.db")
+    )
+    asyncio.run(store.add_turn(store.get("thread-1"), "Leave days?", "20 days."))
+    store.get("thread-2")
+    store.get("thread-3")
+    assert list(store.sessions) == ["thread-2", "thread-3"]
+    # Loaded back from SQLite on its next turn
+    session = store.get("thread-1")
+    assert session.turns == [("User", "Leave days?"), ("Assistant", "20 days.")]
+    assert list(store.sessions) == ["thread-3", "thread-1"]
+
+
+def test_evicted_session_without_spilling_starts_over():
+    store = ConversationStore(max_sessions=1)
+    asyncio.run(store.add_turn(store.get("thread-1"), "Leave days?", "20 days."))
+    store.get("thread-2")
+    assert store.get("thread-1").turns == []
+
+
+def test_expired_session_starts_over(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("conversation.time.time", lambda: now)
+    store = ConversationStore(ttl_seconds=60)
+    asyncio.run(store.add_turn(store.get("thread-1"), "Leave days?", "20 days."))
+    now += 61
+    assert store.get("thread-1").turns == []
+
+
+def test_old_turns_are_summarized():
+    summaries = []
+
+    async def summarize(summary: str, turns: list[tuple[str, str]]) -> str:
+        summaries.append((summary, turns))
+        return f"{summary} {turns[0][1]}".strip()
+
+    store = ConversationStore(
+        token_budget=10, keep_turns=2, count_tokens=len, summarize=summarize
+    )
+    session = store.get("thread-1")
+
+    async def main():
+        await store.add_turn(session, "Leave days?", "20 days.")
+        await store.add_turn(session, "Carry over?", "Until March.")
+
+    asyncio.run(main())
+    assert summaries == [("", [("User", "Leave days?"), ("Assistant", "20 days.")])]
+    assert session.summary == "Leave days?"
+    assert session.turns == [("User", "Carry over?"), ("Assistant", "Until March.")]
+    assert store.history(session).startswith(
+        "Summary of the earlier conversation: Leave days?"
+    )
+
+
+def test_failed_summary_falls_back_to_truncation():
+    async def summarize(summary: str, turns: list[tuple[str, str]]) -> str:
+        raise RuntimeError("LLM unavailable")
+
+    store = ConversationStore(
+        token_budget=10, keep_turns=2, count_tokens=len, summarize=summarize
+    )
+    session = store.get("thread-1")
+
+    async def main():
+        await store.add_turn(session, "Leave days?", "20 days.")
+        await store.add_turn(session, "Carry over?", "Until March.")
+
+    asyncio.run(main())
+    # The summary keeps the last token_budget * 2 characters of the old turns
+    assert session.summary == "Leave days? 20 days."
+    assert len(session.turns) == 2
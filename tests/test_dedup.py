@@ -0,0 +1,61 @@
+import pathlib
+
+from langchain.docstore.document import Document
+
+from dedup import NearDuplicateIndex, deduplicate_chunks, deduplicate_documents
+
+POLICY = (
+    "Employees are entitled to twenty days of paid leave per calendar year. "
+    "Leave must be requested at least two weeks in advance through the HR "
+    "portal, and unused days can be carried over to the first quarter of the "
+    "following year. Sick leave is tracked separately and requires a note "
+    "from a doctor after three consecutive days of absence."
+)
+OTHER = (
+    "Travel expenses are reimbursed within thirty days of submitting the "
+    "receipts. Economy class is booked for flights under six hours, and hotel "
+    "rates must stay within the limits published for each city."
+)
+
+
+def test_near_duplicate_index():
+    index = NearDuplicateIndex(threshold=0.7)
+    assert index.add("a", POLICY) is None
+    assert index.add("b", OTHER) is None
+    # A one word edit keeps most shingles
+    assert index.add("c", POLICY.replace("twenty", "twenty five")) == "a"
+    assert index.add("d", POLICY.upper()) == "a"
+    assert set(index.signatures) == {"a", "b"}
+
+
+def test_deduplicate_documents_records_duplicate_urls():
+    documents = [
+        ("html", [Document(POLICY, {"source": "/kb/wiki/leave.html"})]),
+        ("html", [Document(OTHER, {"source": "/kb/wiki/travel.html"})]),
+        ("pdf", [Document(POLICY + " ", {"source": "/kb/drive/leave.pdf"})]),
+    ]
+    meta_lookup = {
+        pathlib.Path("/kb/wiki/leave.html"): {"url": "https://wiki/leave"},
+        pathlib.Path("/kb/drive/leave.pdf"): {"url": "https://drive/leave"},
+    }
+    kept, dropped = deduplicate_documents(documents, meta_lookup)
+    assert [document[0].metadata["source"] for _, document in kept] == [
+        "/kb/wiki/leave.html",
+        "/kb/wiki/travel.html",
+    ]
+    assert dropped == {"/kb/drive/leave.pdf": "/kb/wiki/leave.html"}
+    assert kept[0][1][0].metadata["duplicate_urls"] == ["https://drive/leave"]
+    assert "duplicate_urls" not in kept[1][1][0].metadata
+
+
+def test_deduplicate_chunks():
+    chunks = [
+        Document(POLICY, {"url": "https://wiki/leave"}),
+        Document(OTHER, {"url": "https://wiki/travel"}),
+        Document(POLICY, {"url": "https://drive/leave"}),
+        Document(POLICY, {"url": "https://wiki/leave"}),
+    ]
+    kept = deduplicate_chunks(chunks)
+    assert kept == chunks[:2]
+    # The url of the kept chunk itself isn't recorded as a duplicate
+    assert kept[0].metadata["duplicate_urls"] == ["https://drive/leave"]
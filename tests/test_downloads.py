@@ -0,0 +1,21 @@
+import pytest
+
+from downloads import AttachmentTooLargeError, write_chunks
+
+
+def test_write_chunks(tmp_path):
+    path = tmp_path / "files" / "policy.pdf"
+    result = write_chunks([b"abc", b"def"], path)
+    assert path.read_bytes() == b"abcdef"
+    assert result["size"] == 6
+    assert result["sha256"] == (
+        "bef57ec7f53a6d40beb640a780a639c83bc29ac8a9816f1fc6c5c6dcd93c4721"
+    )
+    assert not path.with_name("policy.pdf.part").exists()
+
+
+def test_write_chunks_over_the_size_limit(tmp_path):
+    path = tmp_path / "policy.pdf"
+    with pytest.raises(AttachmentTooLargeError):
+        write_chunks([b"abc", b"def"], path, max_bytes=5)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,113 @@
+from html_loader import HTMLTextLoader, html_to_text
+
+
+def test_keeps_headings_and_paragraphs():
+    html = (
+        "<html><head><title> Travel </title><script>var x = 1;</script></head>"
+        "<body><h1>Policy</h1><p>Book early.</p><p>Keep receipts.</p></body></html>"
+    )
+    text, title = html_to_text(html)
+    assert title == "Travel"
+    assert text == "# Policy\n\nBook early.\n\nKeep receipts."
+
+
+def test_uses_main_content_region():
+    html = (
+        "<body><nav>Home | About</nav><main><h2>Expenses</h2><p>Body</p></main>"
+        "<footer>Copyright</footer></body>"
+    )
+    text, _ = html_to_text(html)
+    assert text == "## Expenses\n\nBody"
+
+
+def test_drops_navigation_by_whole_class_name():
+    html = (
+        '<body><div class="menu">Home</div><div id="sidebar">Links</div>'
+        "<p>Content</p></body>"
+    )
+    text, _ = html_to_text(html)
+    assert text == "Content"
+
+
+def test_keeps_classes_containing_boilerplate_words():
+    html = (
+        '<body><div class="layout has-sidebar"><h1>Policy</h1>'
+        "<p>Important body text</p></div>"
+        '<ul><li class="table-menu-item">Item</li></ul></body>'
+    )
+    text, _ = html_to_text(html)
+    assert text == "# Policy\n\nImportant body text\n\nItem"
+
+
+def test_keeps_boilerplate_element_holding_most_of_the_text():
+    html = (
+        '<body><div class="sidebar"><p>All of the page content is in here.</p></div>'
+        "<p>Short</p></body>"
+    )
+    text, _ = html_to_text(html)
+    assert "All of the page content is in here." in text
+
+
+def test_separates_table_cells():
+    html = (
+        "<body><table><tr><th>Name</th><th>Days</th></tr>"
+        "<tr><td>a</td><td>b</td></tr></table></body>"
+    )
+    text, _ = html_to_text(html)
+    assert text == "Name | Days\n\na | b"
+
+
+def test_xml_declaration():
+    html = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        "<html><body><p>Café</p></body></html>"
+    )
+    assert html_to_text(html)[0] == "Café"
+    assert html_to_text(html.encode("utf-8"))[0] == "Café"
+
+
+def test_empty_and_comment_only_pages():
+    assert html_to_text("") == ("", None)
+    assert html_to_text(b"  \n") == ("", None)
+    assert html_to_text("<!-- nothing here -->") == ("", None)
+
+
+def test_loader_reads_xhtml_file(tmp_path):
+    path = tmp_path / "page.html"
+    path.write_bytes(
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<html xmlns="http://www.w3.org/1999/xhtml"><head><title>T</title></head>'
+        b"<body><p>Caf\xc3\xa9</p></body></html>"
+    )
+    [document] = HTMLTextLoader(path).load()
+    assert document.page_content == "Café"
+    assert document.metadata == {"source": str(path), "title": "T"}
+
+
+def test_keeps_page_wrapped_in_a_form():
+    html = (
+        '<body><form id="aspnetForm"><div class="nav">Home</div>'
+        "<h1>Leave policy</h1><p>Employees get 20 days.</p></form></body>"
+    )
+    text, _ = html_to_text(html)
+    assert text == "# Leave policy\n\nEmployees get 20 days."
+
+
+def test_keeps_header_and_footer_of_the_main_content():
+    html = (
+        "<body><header>Site name</header>"
+        "<article><header><h1>Leave policy</h1></header>"
+        "<p>Employees get 20 days.</p><footer>Updated in May</footer></article>"
+        "<footer>Copyright</footer></body>"
+    )
+    text, _ = html_to_text(html)
+    assert text == "# Leave policy\n\nEmployees get 20 days.\n\nUpdated in May"
+
+
+def test_keeps_chrome_tag_holding_most_of_the_text():
+    html = (
+        "<body><header><h1>Leave policy</h1><p>Employees get 20 days of leave.</p>"
+        "</header><footer>Copyright</footer></body>"
+    )
+    text, _ = html_to_text(html)
+    assert text == "# Leave policy\n\nEmployees get 20 days of leave."
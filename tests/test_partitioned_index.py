@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from partitioned_index import PartitionedIndex
+from quantized_index import QuantizedIndex, normalize
+
+
+def make_index(quantization: str = "none") -> tuple[PartitionedIndex, np.ndarray]:
+    rng = np.random.default_rng(0)
+    vectors = normalize(rng.normal(size=(200, 16)))
+    ids = [f"node-{i}" for i in range(len(vectors))]
+    metadata = [
+        {
+            "origin": ["wiki", "drive"][i % 2],
+            "file_type": ["pdf", "html", "docx"][i % 3],
+        }
+        for i in range(len(vectors))
+    ]
+    index = QuantizedIndex(vectors, ids, quantization=quantization)
+    return PartitionedIndex.from_metadata(index, metadata), vectors
+
+
+def exact_top_k(vectors: np.ndarray, query: np.ndarray, k: int, rows=None):
+    rows = np.arange(len(vectors)) if rows is None else rows
+    scores = vectors[rows] @ query
+    return [f"node-{rows[i]}" for i in np.argsort(-scores)[:k]]
+
+
+def test_unfiltered_search_is_exact():
+    index, vectors = make_index()
+    query = vectors[7]
+    [results] = index.search(query, k=5)
+    assert [node_id for node_id, _ in results] == exact_top_k(vectors, query, 5)
+    assert results[0] == ("node-7", results[0][1])
+    assert np.isclose(results[0][1], 1.0)
+
+
+def test_filters_and_fields_or_values():
+    index, _ = make_index()
+    rows = index.rows_for({"origin": "wiki", "file_type": ["pdf", "html"]})
+    expected = [i for i in range(200) if i % 2 == 0 and i % 3 in (0, 1)]
+    assert rows.tolist() == expected
+    assert index.rows_for(None) is None
+    assert index.rows_for({"origin": "missing"}).tolist() == []
+
+
+def test_filtered_search_only_returns_matching_rows():
+    index, vectors = make_index()
+    query = vectors[3]
+    filters = {"origin": "drive", "file_type": "pdf"}
+    rows = index.rows_for(filters)
+    [results] = index.search(query, k=4, filters=filters)
+    assert [node_id for node_id, _ in results] == exact_top_k(vectors, query, 4, rows)
+    assert all(int(node_id.split("-")[1]) % 6 == 3 for node_id, _ in results)
+
+
+def test_unknown_filter_field():
+    index, _ = make_index()
+    with pytest.raises(ValueError, match="author"):
+        index.rows_for({"author": "someone"})
+
+
+def test_save_load_round_trip(tmp_path):
+    index, vectors = make_index(quantization="int8")
+    index.save(tmp_path)
+    loaded = PartitionedIndex.load(tmp_path)
+    filters = {"file_type": "docx"}
+    assert loaded.rows_for(filters).tolist() == index.rows_for(filters).tolist()
+    queries = vectors[:3]
+    assert loaded.search(queries, k=5, filters=filters) == index.search(
+        queries, k=5, filters=filters
+    )
@@ -0,0 +1,1108 @@
+"""Benchmarks for the ingest pipeline."""
+
+import argparse
+import json
+import logging
+import os
+import pathlib
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any
+
+from constants import DIRECTORY_PATH, available_cpus
+from synthetic_corpus import (
+    DEFAULT_MIX,
+    generate_corpus,
+    parse_mix,
+    synthetic_texts,
+    synthetic_vectors,
+)
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_PATH = DIRECTORY_PATH / "logs" / "benchmarks"
+REPO_PATH = pathlib.Path(__file__).resolve().parent.parent
+INGEST_STAGES = ["load", "split", "dedup", "embed", "write", "e2e"]
+# Entry points timed by the imports benchmark: the folder they run from and
+# their arguments
+ENTRY_POINTS = {
+    "vector_store --help": ("vector_store", ["vector_store.py", "--help"]),
+    "benchmark --help": ("vector_store", ["benchmark.py", "--help"]),
+    "delete_knowledge": ("vector_store", ["-c", "import delete_knowledge"]),
+    "ingest_data": ("vector_store", ["-c", "import ingest_data"]),
+    "agent_service": ("services", ["-c", "import agent_service"]),
+    "slack_service": ("services", ["-c", "import slack_service"]),
+}
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of this process so the next stage is measured alone."""
+    # Writing "5" to clear_refs resets VmHWM on Linux; elsewhere the peak is
+    # the high-water mark since process start.
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process and its children, in MB."""
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak_kb = int(line.split()[1])
+    except OSError:
+        pass
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(peak_kb, children_kb) / 1024, 1)
+
+
+class StageTimer:
+    """Collect wall time, peak RSS and throughput for named stages."""
+
+    def __init__(self, record: list[str] | None = None):
+        self.record = record
+        self.stages: dict[str, dict[str, Any]] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the wrapped block; set `counts` on the yielded dict for rates."""
+        reset_peak_rss()
+        result: dict[str, Any] = {"counts": {}}
+        start = time.perf_counter()
+        yield result
+        seconds = time.perf_counter() - start
+        if self.record is not None and name not in self.record:
+            return
+        stage = {"seconds": round(seconds, 4), "peak_rss_mb": peak_rss_mb()}
+        for unit, count in result["counts"].items():
+            stage[unit] = count
+            stage[f"{unit}_per_sec"] = round(count / seconds, 2) if seconds else None
+        self.stages[name] = stage
+        logger.info(f"Stage {name}: {stage}")
+
+
+def save_results(
+    kind: str,
+    params: dict[str, Any],
+    results: dict[str, Any],
+    output: pathlib.Path | None = None,
+) -> pathlib.Path:
+    """Write benchmark results to a JSON file that `compare` can diff."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    timestamp = datetime.now()
+    report = {
+        "kind": kind,
+        "timestamp": timestamp.isoformat(),
+        "commit": commit,
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": available_cpus(),
+        },
+        "params": {key: str(value) for key, value in params.items()},
+        "results": results,
+    }
+    if output is None:
+        output = BENCHMARK_PATH / f"{kind}-{timestamp:%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    logger.info(f"Results written to {output}")
+    return output
+
+
+def print_results(results: dict[str, dict[str, Any]]):
+    """Print one row per result with its metrics."""
+    for name, metrics in results.items():
+        values = ", ".join(f"{key}={value}" for key, value in metrics.items())
+        print(f"{name:<24} {values}")
+
+
+def _write_embeddings(db, chunks, embeddings: list[list[float]]):
+    """Write precomputed embeddings so the write stage excludes embedding time."""
+    texts = [chunk.page_content for chunk in chunks]
+    metadatas = [chunk.metadata for chunk in chunks]
+    if hasattr(db, "add_embeddings"):
+        batch_size = 150
+        for i in range(0, len(chunks), batch_size):
+            db.add_embeddings(
+                texts=texts[i:i + batch_size],
+                embeddings=embeddings[i:i + batch_size],
+                metadatas=metadatas[i:i + batch_size],
+            )
+    else:
+        for i, (text, vector, metadata) in enumerate(zip(texts, embeddings, metadatas)):
+            db.store[str(i)] = {
+                "id": str(i),
+                "vector": vector,
+                "text": text,
+                "metadata": metadata,
+            }
+
+
+def run_ingest(args: argparse.Namespace) -> dict[str, Any]:
+    """Benchmark each ingest stage in isolation and the whole run end-to-end."""
+    from ingest_data import (
+        chunk_documents,
+        get_embedder,
+        get_vectorstore,
+        ingest,
+    )
+    from dedup import deduplicate_chunks
+    from split import load_documents
+
+    record = args.stages.split(",")
+    unknown = set(record) - set(INGEST_STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}, expected {INGEST_STAGES}")
+    timer = StageTimer(record=record)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_dir = args.corpus or pathlib.Path(tmp_dir)
+        if corpus_dir.exists() and any(corpus_dir.iterdir()):
+            logger.info(f"Reusing corpus in {corpus_dir}")
+            meta_lookup = {}
+        else:
+            meta_lookup = generate_corpus(
+                corpus_dir,
+                args.docs,
+                mix=args.mix,
+                duplicate_rate=args.duplicate_rate,
+                seed=args.seed,
+            )
+
+        collection_name = f"benchmark_{args.seed}"
+        # Earlier stages always run since they produce the input of later ones
+        last_stage = max(
+            (INGEST_STAGES.index(stage) for stage in record if stage != "e2e"),
+            default=-1,
+        )
+
+        def needed(stage: str) -> bool:
+            return last_stage >= INGEST_STAGES.index(stage)
+
+        if needed("load"):
+            with timer.stage("load") as stage:
+                documents = load_documents(corpus_dir, ingest_threads=args.threads)
+                stage["counts"]["docs"] = len(documents)
+        if needed("split"):
+            with timer.stage("split") as stage:
+                chunks, _ = chunk_documents(
+                    documents,
+                    meta_lookup,
+                    chunk_size=args.chunk_size,
+                    chunk_overlap=args.chunk_overlap,
+                    source_dir=corpus_dir,
+                )
+                stage["counts"]["chunks"] = len(chunks)
+        if needed("dedup") and args.dedup:
+            # Chunk level only, document level dedup is part of the e2e run
+            with timer.stage("dedup") as stage:
+                n_chunks = len(chunks)
+                chunks = deduplicate_chunks(chunks, threshold=args.dedup_threshold)
+                stage["counts"]["chunks"] = n_chunks
+            if "dedup" in timer.stages:
+                timer.stages["dedup"]["embeddings_avoided"] = n_chunks - len(chunks)
+        if needed("embed"):
+            embedder = get_embedder(args.embedding_model)
+            with timer.stage("embed") as stage:
+                embeddings = embedder.embed_documents(
+                    [chunk.page_content for chunk in chunks]
+                )
+                stage["counts"]["chunks"] = len(chunks)
+        if needed("write"):
+            db = get_vectorstore(collection_name, embedder, store=args.store)
+            if args.store == "pgvector":
+                db.delete_collection()
+                db.create_collection()
+            with timer.stage("write") as stage:
+                _write_embeddings(db, chunks, embeddings)
+                stage["counts"]["chunks"] = len(chunks)
+
+        if "e2e" in record:
+            with timer.stage("e2e") as stage:
+                summary = ingest(
+                    meta_lookup=meta_lookup,
+                    collection_name=collection_name,
+                    chunk_size=args.chunk_size,
+                    chunk_overlap=args.chunk_overlap,
+                    ingest_threads=args.threads,
+                    embedding_model_name=args.embedding_model,
+                    source_dir=corpus_dir,
+                    store=args.store,
+                    dedup=args.dedup,
+                    dedup_threshold=args.dedup_threshold,
+                )
+                stage["counts"]["docs"] = summary["documents"]
+                stage["counts"]["chunks"] = summary["chunks"]
+            timer.stages["e2e"]["embeddings_avoided"] = summary["embeddings_avoided"]
+
+    return timer.stages
+
+
+def _latency_ms(fn, inputs: list) -> dict[str, float]:
+    """Call `fn` once per input and summarize the latency distribution."""
+    latencies = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)], 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+    }
+
+
+def _benchmark_embedder(backend: str, model_name: str, threads: int | None):
+    """Return (embed_query, embed_documents) callables for a backend."""
+    if backend == "openai":
+        # The query path of the agent service
+        from llama_index.embeddings.openai import OpenAIEmbedding
+
+        embed_model = OpenAIEmbedding(api_key=os.getenv("OPENAI_API_KEY"))
+        return embed_model.get_query_embedding, embed_model.get_text_embedding_batch
+
+    from ingest_data import get_embedder
+
+    embedder = get_embedder(model_name, backend=backend, threads=threads)
+    return embedder.embed_query, embedder.embed_documents
+
+
+def run_embed(args: argparse.Namespace) -> dict[str, Any]:
+    """Benchmark per-query latency and ingest throughput of embedding backends."""
+    queries = synthetic_texts(args.queries, min_sentences=1, max_sentences=1, seed=1)
+    chunks = synthetic_texts(args.chunks, seed=args.seed)
+    timer = StageTimer()
+    results = {}
+    for backend in args.backends.split(","):
+        with timer.stage(f"{backend}:load"):
+            embed_query, embed_documents = _benchmark_embedder(
+                backend, args.embedding_model, args.threads
+            )
+        # Warm up so lazy initialization isn't counted against the first query
+        embed_query(queries[0])
+        results[f"{backend}:query"] = _latency_ms(embed_query, queries)
+        with timer.stage(f"{backend}:ingest") as stage:
+            embed_documents(chunks)
+            stage["counts"]["chunks"] = len(chunks)
+    return timer.stages | results
+
+
+def _worker_counts(spec: str | None) -> list[int]:
+    """Parse '1,2,4', defaulting to powers of two up to the usable cores."""
+    if spec:
+        return [int(workers) for workers in spec.split(",")]
+    cpus = available_cpus()
+    counts = [2**i for i in range(cpus.bit_length()) if 2**i < cpus]
+    return counts + [cpus]
+
+
+def run_embed_scaling(args: argparse.Namespace) -> dict[str, Any]:
+    """Benchmark chunks/sec of the embedding pool from 1 to N worker processes."""
+    from embedding_pool import EmbeddingPool
+
+    chunks = synthetic_texts(args.chunks, seed=args.seed)
+    timer = StageTimer()
+    results = {}
+    baseline = None
+    for workers in _worker_counts(args.workers):
+        with EmbeddingPool(
+            args.embedding_model,
+            backend=args.backend,
+            workers=workers,
+            threads_per_worker=args.threads_per_worker,
+            batch_size=args.batch_size,
+        ) as pool:
+            # Model loading is reported apart from the embedding throughput
+            with timer.stage(f"{workers}:load"):
+                pool.start()
+            start = time.perf_counter()
+            with timer.stage(f"{workers}:embed") as stage:
+                embeddings = pool.embed_documents(chunks)
+                stage["counts"]["chunks"] = len(embeddings)
+            chunks_per_sec = len(chunks) / (time.perf_counter() - start)
+        baseline = baseline or chunks_per_sec
+        results[f"{workers}:scaling"] = {
+            "workers": workers,
+            "threads_per_worker": pool.threads_per_worker,
+            "chunks_per_sec": round(chunks_per_sec, 2),
+            "speedup": round(chunks_per_sec / baseline, 2),
+        }
+    return timer.stages | results
+
+
+def _recall(
+    results: list[list[tuple[str, float]]], truth: list[list[tuple[str, float]]]
+) -> float:
+    """Mean fraction of the exact top-k found by an approximate search."""
+    recalls = [
+        len({i for i, _ in found} & {i for i, _ in expected}) / len(expected)
+        for found, expected in zip(results, truth)
+        if expected
+    ]
+    return round(sum(recalls) / len(recalls), 4)
+
+
+def run_quantization(args: argparse.Namespace) -> dict[str, Any]:
+    """Compare memory, query latency and recall of quantized indexes."""
+    from quantized_index import QUANTIZATIONS, QuantizedIndex
+
+    vectors = synthetic_vectors(args.vectors, dim=args.dim, seed=args.seed)
+    queries = synthetic_vectors(args.queries, dim=args.dim, seed=args.seed + 1)
+    ids = [str(i) for i in range(len(vectors))]
+    truth = QuantizedIndex(vectors, ids, quantization="none").search(queries, args.k)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for quantization in QUANTIZATIONS:
+            path = pathlib.Path(tmp_dir) / quantization
+            QuantizedIndex(vectors, ids, quantization=quantization).save(path)
+            index = QuantizedIndex.load(path, rescore_factor=args.rescore_factor)
+            found = [index.search(query, args.k)[0] for query in queries]
+            results[quantization] = {
+                "search_mb": round(index.nbytes["search"] / 2**20, 2),
+                "full_precision_mb": round(index.nbytes["full_precision"] / 2**20, 2),
+                **_latency_ms(lambda query: index.search(query, args.k), list(queries)),
+                f"recall@{args.k}": _recall(found, truth),
+            }
+    return results
+
+
+def run_partitions(args: argparse.Namespace) -> dict[str, Any]:
+    """Compare latency of filtered and unfiltered queries as partitions grow."""
+    from partitioned_index import PartitionedIndex
+    from quantized_index import QuantizedIndex
+
+    vectors = synthetic_vectors(args.vectors, dim=args.dim, seed=args.seed)
+    queries = list(synthetic_vectors(args.queries, dim=args.dim, seed=args.seed + 1))
+    ids = [str(i) for i in range(len(vectors))]
+    index = QuantizedIndex(vectors, ids, quantization=args.quantization)
+
+    results = {}
+    for n_partitions in [int(n) for n in args.partitions.split(",")]:
+        metadata = [{"origin": f"origin-{i % n_partitions}"} for i in range(len(ids))]
+        partitioned = PartitionedIndex.from_metadata(index, metadata, fields=["origin"])
+        filters = {"origin": "origin-0"}
+
+        def post_filtered(query):
+            # Baseline: global search for enough results, then drop other origins
+            found = index.search(query, k=args.k * n_partitions)[0]
+            return [(i, score) for i, score in found if int(i) % n_partitions == 0]
+
+        unfiltered = _latency_ms(
+            lambda query: partitioned.search(query, args.k), queries
+        )
+        filtered = _latency_ms(
+            lambda query: partitioned.search(query, args.k, filters=filters), queries
+        )
+        results[f"{n_partitions}_partitions"] = {
+            "unfiltered_p50_ms": unfiltered["p50_ms"],
+            "filtered_p50_ms": filtered["p50_ms"],
+            "post_filtered_p50_ms": _latency_ms(post_filtered, queries)["p50_ms"],
+            "filtered_rows": len(partitioned.rows_for(filters)),
+        }
+    return results
+
+
+def _pgvector_search(conn, query: str, settings: list, embedding, k: int):
+    """Run one nearest neighbour query with its SET LOCAL settings."""
+    from pgvector_index import to_pgvector
+
+    with conn.transaction():
+        for setting in settings:
+            conn.execute(setting)
+        rows = conn.execute(query, {"embedding": to_pgvector(embedding), "k": k})
+        return [(row[0], row[3]) for row in rows.fetchall()]
+
+
+async def _pgvector_throughput(
+    conninfo: str, query, settings: list, queries, k: int, concurrency: int
+) -> float:
+    """Queries/sec of concurrent searches on an async connection pool."""
+    import asyncio
+
+    from pgvector_index import to_pgvector
+    from psycopg_pool import AsyncConnectionPool
+
+    async with AsyncConnectionPool(
+        conninfo, min_size=concurrency, max_size=concurrency
+    ) as pool:
+
+        async def search(embedding):
+            async with pool.connection() as conn:
+                async with conn.transaction():
+                    for setting in settings:
+                        await conn.execute(setting)
+                    cursor = await conn.execute(
+                        query, {"embedding": to_pgvector(embedding), "k": k}
+                    )
+                    await cursor.fetchall()
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(embedding):
+            async with semaphore:
+                await search(embedding)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded(embedding) for embedding in queries))
+        return round(len(queries) / (time.perf_counter() - start), 2)
+
+
+def run_pgvector(args: argparse.Namespace) -> dict[str, Any]:
+    """Compare exact and ANN search on the configured PGVector database."""
+    import asyncio
+
+    import numpy as np
+    import psycopg
+    from constants import (
+        PGVECTOR_DATABASE_NAME,
+        PGVECTOR_HOST,
+        PGVECTOR_PASS,
+        PGVECTOR_PORT,
+        PGVECTOR_USER,
+    )
+    from ingest_data import get_vectorstore
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from pgvector_index import (
+        EMBEDDING_TABLE,
+        create_ann_index,
+        get_collection_id,
+        pgvector_conninfo,
+        search_query,
+        search_settings,
+        to_pgvector,
+    )
+
+    conninfo = pgvector_conninfo(
+        host=PGVECTOR_HOST,
+        port=int(PGVECTOR_PORT),
+        database=PGVECTOR_DATABASE_NAME,
+        user=PGVECTOR_USER,
+        password=PGVECTOR_PASS,
+    )
+    collection_name = f"benchmark_{args.vectors}"
+    vectors = synthetic_vectors(args.vectors, dim=args.dim, seed=args.seed)
+    queries = synthetic_vectors(args.queries, dim=args.dim, seed=args.seed + 1)
+    filters = {"origin": "origin-0"}
+    in_partition = np.arange(len(vectors)) % args.partitions == 0
+
+    # Exact top k of the unit vectors, for recall
+    def exact(mask=None):
+        scores = queries @ vectors.T
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+        top = np.argsort(-scores, axis=1)[:, : args.k]
+        return [[(str(i), 0.0) for i in row] for row in top]
+
+    truth = exact()
+    filtered_truth = exact(in_partition)
+
+    # Creates the PGVector tables if needed and an empty collection
+    db = get_vectorstore(collection_name, DeterministicFakeEmbedding(size=args.dim))
+    db.delete_collection()
+    db.create_collection()
+
+    timer = StageTimer()
+    results = {}
+    with psycopg.connect(conninfo, autocommit=True) as conn:
+        collection_id = get_collection_id(conn, collection_name)
+        with timer.stage("load") as stage:
+            with conn.cursor() as cursor:
+                with cursor.copy(
+                    f"COPY {EMBEDDING_TABLE} "
+                    "(id, collection_id, embedding, document, cmetadata) FROM STDIN"
+                ) as copy:
+                    for i, vector in enumerate(vectors):
+                        metadata = {"origin": f"origin-{i % args.partitions}"}
+                        copy.write_row(
+                            (str(i), collection_id, to_pgvector(vector), "", json.dumps(metadata))
+                        )
+            conn.execute(f"ANALYZE {EMBEDDING_TABLE}")
+            stage["counts"]["vectors"] = len(vectors)
+
+        query = search_query(collection_id, args.dim)
+        filtered_query = search_query(collection_id, args.dim, filters)
+        exact_queries = list(queries[: args.exact_queries])
+        results["exact"] = _latency_ms(
+            lambda q: _pgvector_search(conn, query, [], q, args.k), exact_queries
+        )
+
+        with timer.stage(f"build_{args.index_type}") as stage:
+            create_ann_index(
+                conn,
+                collection_name,
+                index_type=args.index_type,
+                m=args.m,
+                ef_construction=args.ef_construction,
+                recreate=True,
+                maintenance_work_mem=args.maintenance_work_mem,
+            )
+            stage["counts"]["vectors"] = len(vectors)
+
+        # ef_search for HNSW, probes for IVFFlat
+        setting_name = "ef_search" if args.index_type == "hnsw" else "probes"
+        for value in [int(v) for v in args.search_values.split(",")]:
+            settings = search_settings(**{setting_name: value})
+            for name, sql_query, expected in [
+                ("", query, truth),
+                ("filtered:", filtered_query, filtered_truth),
+            ]:
+                found = [
+                    _pgvector_search(conn, sql_query, settings, q, args.k)
+                    for q in queries
+                ]
+                results[f"{name}{setting_name}={value}"] = {
+                    **_latency_ms(
+                        lambda q: _pgvector_search(conn, sql_query, settings, q, args.k),
+                        list(queries),
+                    ),
+                    f"recall@{args.k}": _recall(found, expected),
+                    "queries_per_sec": asyncio.run(
+                        _pgvector_throughput(
+                            conninfo,
+                            sql_query,
+                            settings,
+                            list(queries),
+                            args.k,
+                            args.concurrency,
+                        )
+                    ),
+                }
+
+    if not args.keep:
+        db.delete_collection()
+    return timer.stages | results
+
+
+def run_downloads(args: argparse.Namespace) -> dict[str, Any]:
+    """Compare peak memory of buffered and streamed attachment downloads."""
+    import functools
+    import threading
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+    import requests
+
+    from downloads import download
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        served = pathlib.Path(tmp_dir) / "served"
+        served.mkdir()
+        chunk = os.urandom(1024 * 1024)
+        for i in range(args.files):
+            with open(served / f"attachment-{i}.pdf", "wb") as f:
+                for _ in range(args.size_mb):
+                    f.write(chunk)
+        del chunk
+
+        class QuietHandler(SimpleHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        handler = functools.partial(QuietHandler, directory=str(served))
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls = [
+            f"http://127.0.0.1:{server.server_port}/attachment-{i}.pdf"
+            for i in range(args.files)
+        ]
+
+        timer = StageTimer()
+        session = requests.Session()
+        try:
+            with timer.stage("buffered") as stage:
+                # The previous behaviour: every binary held in memory until
+                # the crawl is written out
+                contents = [session.get(url).content for url in urls]
+                for i, content in enumerate(contents):
+                    (pathlib.Path(tmp_dir) / f"buffered-{i}.pdf").write_bytes(content)
+                stage["counts"]["megabytes"] = args.files * args.size_mb
+            del contents
+            with timer.stage("streamed") as stage:
+                for i, url in enumerate(urls):
+                    download(
+                        session,
+                        url,
+                        pathlib.Path(tmp_dir) / f"streamed-{i}.pdf",
+                        max_bytes=None,
+                    )
+                stage["counts"]["megabytes"] = args.files * args.size_mb
+        finally:
+            server.shutdown()
+    return timer.stages
+
+
+def run_html(args: argparse.Namespace) -> dict[str, Any]:
+    """Compare raw markup loading of HTML pages with main content extraction."""
+    from html_loader import HTMLTextLoader
+    from langchain.text_splitter import Language, RecursiveCharacterTextSplitter
+    from langchain_community.document_loaders import TextLoader
+
+    loaders = {
+        "raw": (TextLoader, Language.HTML),
+        "extracted": (HTMLTextLoader, Language.MARKDOWN),
+    }
+    timer = StageTimer()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fixtures_dir = args.fixtures or pathlib.Path(tmp_dir)
+        if args.fixtures is None:
+            generate_corpus(fixtures_dir, args.docs, mix={".html": 1.0}, seed=args.seed)
+        paths = sorted(fixtures_dir.rglob("*.html"))
+        for name, (loader_class, language) in loaders.items():
+            splitter = RecursiveCharacterTextSplitter.from_language(
+                language=language,
+                chunk_size=args.chunk_size,
+                chunk_overlap=args.chunk_overlap,
+            )
+            with timer.stage(name) as stage:
+                documents = [
+                    document
+                    for path in paths
+                    for document in loader_class(str(path)).load()
+                ]
+                chunks = splitter.split_documents(documents)
+                stage["counts"]["docs"] = len(documents)
+                stage["counts"]["chunks"] = len(chunks)
+            timer.stages[name]["characters"] = sum(
+                len(document.page_content) for document in documents
+            )
+    return timer.stages
+
+
+def _percentiles(values: list[int], prefix: str) -> dict[str, int]:
+    """p10, p50 and p90 of a list of sizes."""
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        f"{prefix}_p{p}": values[min(len(values) - 1, len(values) * p // 100)]
+        for p in (10, 50, 90)
+    }
+
+
+def run_split(args: argparse.Namespace) -> dict[str, Any]:
+    """Compare chunks/sec and chunk sizes of the splitter modes."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    from split import (
+        DOCUMENT_MAP,
+        _get_tokenizer,
+        get_splitter,
+        load_documents,
+        split_documents,
+    )
+
+    def uncached_split(document, extension):
+        # The original split_document, building a splitter for every document
+        language = DOCUMENT_MAP[extension].get("language")
+        if "language" not in DOCUMENT_MAP[extension]:
+            return [document]
+        if language is None:
+            splitter = RecursiveCharacterTextSplitter(
+                chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap
+            )
+        else:
+            splitter = RecursiveCharacterTextSplitter.from_language(
+                language=language,
+                chunk_size=args.chunk_size,
+                chunk_overlap=args.chunk_overlap,
+            )
+        return splitter.split_documents([document])
+
+    tokenizer = _get_tokenizer(args.embedding_model)
+    modes = {
+        "uncached": lambda documents: [
+            uncached_split(document, extension) for extension, document in documents
+        ],
+        "cached": lambda documents: split_documents(
+            documents, args.chunk_size, args.chunk_overlap
+        ),
+        f"cached_{args.workers}_workers": lambda documents: split_documents(
+            documents, args.chunk_size, args.chunk_overlap, workers=args.workers
+        ),
+        "tokens": lambda documents: split_documents(
+            documents,
+            args.token_chunk_size,
+            args.token_chunk_overlap,
+            tokenizer_name=args.embedding_model,
+            workers=args.workers,
+        ),
+    }
+    timer = StageTimer()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_dir = pathlib.Path(tmp_dir)
+        generate_corpus(corpus_dir, args.docs, mix=args.mix, seed=args.seed)
+        documents = [
+            (extension, document[0])
+            for extension, document in load_documents(corpus_dir, ingest_threads=8)
+        ]
+        for name, split in modes.items():
+            get_splitter.cache_clear()
+            with timer.stage(name) as stage:
+                chunks = [chunk for chunks in split(documents) for chunk in chunks]
+                stage["counts"]["chunks"] = len(chunks)
+            timer.stages[name] |= _percentiles(
+                [len(chunk.page_content) for chunk in chunks], "chars"
+            ) | _percentiles(
+                [len(tokenizer.tokenize(chunk.page_content)) for chunk in chunks],
+                "tokens",
+            )
+    return timer.stages
+
+
+def _parse_importtime(stderr: str) -> list[tuple[str, int, int]]:
+    """(module, nesting depth, cumulative microseconds) of `-X importtime` output."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), depth, int(cumulative)))
+    return imports
+
+
+def _importtime(folder: str, entry_args: list[str], repeat: int):
+    """Fastest of `repeat` runs: (seconds, process) of `python -X importtime`."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", *entry_args],
+            cwd=REPO_PATH / folder,
+            capture_output=True,
+            text=True,
+        )
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best[0]:
+            best = (seconds, process)
+    return best
+
+
+def run_imports(args: argparse.Namespace) -> dict[str, Any]:
+    """Time the startup and imports of each entry point with `python -X importtime`."""
+    names = args.entry_points.split(",") if args.entry_points else list(ENTRY_POINTS)
+    # Modules imported by the interpreter itself aren't attributed to entry points
+    baseline_seconds, baseline = _importtime("vector_store", ["-c", "pass"], args.repeat)
+    startup_modules = {module for module, _, _ in _parse_importtime(baseline.stderr)}
+    results = {"python -c pass": {"seconds": round(baseline_seconds, 3)}}
+    for name in names:
+        folder, entry_args = ENTRY_POINTS[name]
+        seconds, process = _importtime(folder, entry_args, args.repeat)
+        imports = [
+            item
+            for item in _parse_importtime(process.stderr)
+            if item[0] not in startup_modules
+        ]
+        # The imports of `-c "import module"` are nested under the module
+        depth = 1 if entry_args[0] == "-c" else 0
+        slowest = sorted(
+            (item for item in imports if item[1] == depth), key=lambda item: -item[2]
+        )
+        results[name] = {
+            "seconds": round(seconds, 3),
+            "import_seconds": round(
+                sum(cumulative for _, d, cumulative in imports if d == 0) / 1e6, 3
+            ),
+            "modules": len(imports),
+            "slowest": ", ".join(
+                f"{module}={cumulative / 1e6:.3f}s"
+                for module, _, cumulative in slowest[: args.top]
+            ),
+        }
+        if process.returncode != 0:
+            results[name]["error"] = process.stderr.strip().splitlines()[-1]
+    return results
+
+
+def compare(old_path: pathlib.Path, new_path: pathlib.Path):
+    """Print the relative change of every shared metric between two runs."""
+    old = json.loads(old_path.read_text())
+    new = json.loads(new_path.read_text())
+    if old["kind"] != new["kind"]:
+        logger.warning(f"Comparing a {old['kind']} run with a {new['kind']} run")
+    print(f"{'':<24} {'metric':<20} {'old':>12} {'new':>12} {'change':>9}")
+    for name, new_metrics in new["results"].items():
+        old_metrics = old["results"].get(name, {})
+        for metric, new_value in new_metrics.items():
+            old_value = old_metrics.get(metric)
+            if not isinstance(new_value, (int, float)) or not isinstance(
+                old_value, (int, float)
+            ):
+                continue
+            change = f"{(new_value - old_value) / old_value:+.1%}" if old_value else "n/a"
+            print(f"{name:<24} {metric:<20} {old_value:>12} {new_value:>12} {change:>9}")
+
+
+def main(args: argparse.Namespace) -> None:
+    """Run the selected benchmark and store its results."""
+    if args.command == "compare":
+        compare(args.old, args.new)
+        return
+    results = args.run(args)
+    print_results(results)
+    params = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("command", "run", "output")
+    }
+    save_results(args.command, params, results, output=args.output)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+    )
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--output",
+        type=pathlib.Path,
+        help="Path to write the results to. Defaults to logs/benchmarks/.",
+        default=None,
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser(
+        "ingest", help="Time the load, split, embed and write stages."
+    )
+    ingest_parser.set_defaults(run=run_ingest)
+    ingest_parser.add_argument(
+        "--docs", type=int, default=100, help="Number of synthetic documents."
+    )
+    ingest_parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=DEFAULT_MIX,
+        help="Document mix, e.g. 'pdf=0.4,html=0.3,docx=0.2,csv=0.1'.",
+    )
+    ingest_parser.add_argument(
+        "--corpus",
+        type=pathlib.Path,
+        default=None,
+        help="Folder to generate the corpus in, or reuse if it is not empty.",
+    )
+    ingest_parser.add_argument(
+        "--duplicate-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of documents that are near copies of an earlier one.",
+    )
+    ingest_parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Drop near duplicate documents and chunks before embedding.",
+    )
+    ingest_parser.add_argument("--dedup-threshold", type=float, default=0.9)
+    ingest_parser.add_argument("--seed", type=int, default=0)
+    ingest_parser.add_argument("--chunk-size", type=int, default=500)
+    ingest_parser.add_argument("--chunk-overlap", type=int, default=250)
+    ingest_parser.add_argument("--threads", type=int, default=8)
+    ingest_parser.add_argument(
+        "--embedding-model",
+        default="sentence-transformers/all-MiniLM-L6-v2",
+    )
+    ingest_parser.add_argument(
+        "--store",
+        choices=["memory", "pgvector"],
+        default="memory",
+        help="Write to an in-process store or to the configured PGVector database.",
+    )
+    ingest_parser.add_argument(
+        "--stages",
+        default=",".join(INGEST_STAGES),
+        help=f"Comma separated stages to report, from {INGEST_STAGES}.",
+    )
+
+    embed_parser = subparsers.add_parser(
+        "embed", help="Compare query latency and chunks/sec of embedding backends."
+    )
+    embed_parser.set_defaults(run=run_embed)
+    embed_parser.add_argument(
+        "--backends",
+        default="huggingface,onnx,onnx-int8",
+        help="Comma separated backends: huggingface, onnx, onnx-int8, openai.",
+    )
+    embed_parser.add_argument(
+        "--embedding-model",
+        default="sentence-transformers/all-MiniLM-L6-v2",
+    )
+    embed_parser.add_argument("--queries", type=int, default=200)
+    embed_parser.add_argument("--chunks", type=int, default=2000)
+    embed_parser.add_argument("--threads", type=int, default=None)
+    embed_parser.add_argument("--seed", type=int, default=0)
+
+    scaling_parser = subparsers.add_parser(
+        "embed-scaling",
+        help="Report chunks/sec of the multi-process embedding pool from 1 to N workers.",
+    )
+    scaling_parser.set_defaults(run=run_embed_scaling)
+    scaling_parser.add_argument(
+        "--workers",
+        default=None,
+        help="Comma separated worker counts. Defaults to 1, 2, 4, ... up to the usable cores.",
+    )
+    scaling_parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=1,
+        help="Intra-op threads of each worker.",
+    )
+    scaling_parser.add_argument(
+        "--backend", default="huggingface", choices=["huggingface", "onnx", "onnx-int8"]
+    )
+    scaling_parser.add_argument(
+        "--embedding-model",
+        default="sentence-transformers/all-MiniLM-L6-v2",
+    )
+    scaling_parser.add_argument("--chunks", type=int, default=4000)
+    scaling_parser.add_argument("--batch-size", type=int, default=128)
+    scaling_parser.add_argument("--seed", type=int, default=0)
+
+    quantization_parser = subparsers.add_parser(
+        "quantization",
+        help="Compare memory, latency and recall of int8 and binary vector storage.",
+    )
+    quantization_parser.set_defaults(run=run_quantization)
+    quantization_parser.add_argument("--vectors", type=int, default=100_000)
+    quantization_parser.add_argument("--dim", type=int, default=384)
+    quantization_parser.add_argument("--queries", type=int, default=100)
+    quantization_parser.add_argument("--k", type=int, default=10)
+    quantization_parser.add_argument(
+        "--rescore-factor",
+        type=int,
+        default=None,
+        help="Candidates rescored per result. Defaults to 4 for int8, 256 for binary.",
+    )
+    quantization_parser.add_argument("--seed", type=int, default=0)
+
+    partitions_parser = subparsers.add_parser(
+        "partitions",
+        help="Compare filtered and unfiltered query latency as partitions grow.",
+    )
+    partitions_parser.set_defaults(run=run_partitions)
+    partitions_parser.add_argument("--vectors", type=int, default=100_000)
+    partitions_parser.add_argument("--dim", type=int, default=384)
+    partitions_parser.add_argument("--queries", type=int, default=100)
+    partitions_parser.add_argument("--k", type=int, default=10)
+    partitions_parser.add_argument("--partitions", default="1,4,16,64,256")
+    partitions_parser.add_argument(
+        "--quantization", choices=["none", "int8", "binary"], default="none"
+    )
+    partitions_parser.add_argument("--seed", type=int, default=0)
+
+    pgvector_parser = subparsers.add_parser(
+        "pgvector",
+        help="Compare exact and ANN search latency and recall in PGVector.",
+    )
+    pgvector_parser.set_defaults(run=run_pgvector)
+    pgvector_parser.add_argument(
+        "--vectors", type=int, default=100_000, help="e.g. 100000 or 1000000."
+    )
+    pgvector_parser.add_argument("--dim", type=int, default=384)
+    pgvector_parser.add_argument("--queries", type=int, default=100)
+    pgvector_parser.add_argument(
+        "--exact-queries",
+        type=int,
+        default=10,
+        help="Queries timed without the ANN index, sequential scans are slow.",
+    )
+    pgvector_parser.add_argument("--k", type=int, default=10)
+    pgvector_parser.add_argument("--partitions", type=int, default=16)
+    pgvector_parser.add_argument(
+        "--index-type", choices=["hnsw", "ivfflat"], default="hnsw"
+    )
+    pgvector_parser.add_argument("--m", type=int, default=16)
+    pgvector_parser.add_argument("--ef-construction", type=int, default=64)
+    pgvector_parser.add_argument("--maintenance-work-mem", default="1GB")
+    pgvector_parser.add_argument(
+        "--search-values",
+        default="20,40,100,200",
+        help="Comma separated hnsw.ef_search or ivfflat.probes values.",
+    )
+    pgvector_parser.add_argument("--concurrency", type=int, default=8)
+    pgvector_parser.add_argument(
+        "--keep", action="store_true", help="Keep the benchmark collection."
+    )
+    pgvector_parser.add_argument("--seed", type=int, default=0)
+
+    downloads_parser = subparsers.add_parser(
+        "downloads",
+        help="Compare peak memory of buffered and streamed attachment downloads.",
+    )
+    downloads_parser.set_defaults(run=run_downloads)
+    downloads_parser.add_argument("--files", type=int, default=20)
+    downloads_parser.add_argument("--size-mb", type=int, default=20)
+
+    html_parser = subparsers.add_parser(
+        "html", help="Compare chunk counts of raw and extracted HTML pages."
+    )
+    html_parser.set_defaults(run=run_html)
+    html_parser.add_argument(
+        "--fixtures",
+        type=pathlib.Path,
+        default=None,
+        help="Folder of saved HTML pages. Defaults to synthetic pages.",
+    )
+    html_parser.add_argument("--docs", type=int, default=200)
+    html_parser.add_argument("--chunk-size", type=int, default=500)
+    html_parser.add_argument("--chunk-overlap", type=int, default=250)
+    html_parser.add_argument("--seed", type=int, default=0)
+
+    split_parser = subparsers.add_parser(
+        "split", help="Compare chunks/sec and chunk sizes of the splitter modes."
+    )
+    split_parser.set_defaults(run=run_split)
+    split_parser.add_argument("--docs", type=int, default=200)
+    split_parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    split_parser.add_argument("--chunk-size", type=int, default=500)
+    split_parser.add_argument("--chunk-overlap", type=int, default=250)
+    split_parser.add_argument("--token-chunk-size", type=int, default=256)
+    split_parser.add_argument("--token-chunk-overlap", type=int, default=32)
+    split_parser.add_argument("--workers", type=int, default=4)
+    split_parser.add_argument(
+        "--embedding-model",
+        default="sentence-transformers/all-MiniLM-L6-v2",
+        help="Model whose tokenizer measures chunks in tokens mode.",
+    )
+    split_parser.add_argument("--seed", type=int, default=0)
+
+    imports_parser = subparsers.add_parser(
+        "imports", help="Time startup and imports of each entry point."
+    )
+    imports_parser.set_defaults(run=run_imports)
+    imports_parser.add_argument(
+        "--entry-points",
+        default=None,
+        help=f"Comma separated entry points, from {list(ENTRY_POINTS)}.",
+    )
+    imports_parser.add_argument("--repeat", type=int, default=3)
+    imports_parser.add_argument(
+        "--top", type=int, default=5, help="Slowest top-level imports to report."
+    )
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Diff the results of two benchmark runs."
+    )
+    compare_parser.add_argument("old", type=pathlib.Path)
+    compare_parser.add_argument("new", type=pathlib.Path)
+
+    main(parser.parse_args())
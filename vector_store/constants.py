@@ -1,7 +1,7 @@
+import functools
 import os
 import pathlib
 
-import torch
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,11 +12,25 @@ KNOWLEDGE_REPOSITORY_PATH = DIRECTORY_PATH / "knowledge"
 SOURCE_RESPOSITORY_PATH = KNOWLEDGE_REPOSITORY_PATH / "source"
 
 # INGEST
-DEVICE = (
-    "cuda"
-    if torch.cuda.is_available()
-    else ("mps" if torch.backends.mps.is_available() else "cpu")
-)
+def available_cpus() -> int:
+    """Number of cores this process may run on."""
+    # The affinity mask isn't available on macOS
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+@functools.cache
+def get_device() -> str:
+    """The device to embed on, importing torch only when it is needed."""
+    import torch
+
+    return (
+        "cuda"
+        if torch.cuda.is_available()
+        else ("mps" if torch.backends.mps.is_available() else "cpu")
+    )
+
 
 # PGVECTOR
 PGVECTOR_USER = os.environ.get("PGVECTOR_USER")
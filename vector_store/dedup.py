@@ -0,0 +1,153 @@
+"""Near-duplicate detection with MinHash signatures and LSH."""
+
+import logging
+import pathlib
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+from langchain.docstore.document import Document
+
+logger = logging.getLogger(__name__)
+
+_PRIME = np.uint64(4294967291)  # Largest prime below 2**32
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class NearDuplicateIndex:
+    """
+    Find texts whose word shingles have a Jaccard similarity above a threshold.
+
+    Each text gets a MinHash signature of `num_perm` hashes, split into
+    `bands` bands for locality sensitive hashing: texts sharing any band are
+    candidates, and a candidate is a near duplicate when the fraction of equal
+    hashes, an estimate of the Jaccard similarity, reaches `threshold`.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        num_perm: int = 128,
+        bands: int = 16,
+        shingle_size: int = 5,
+        seed: int = 0,
+    ):
+        if num_perm % bands != 0:
+            raise ValueError(f"num_perm {num_perm} must be a multiple of bands {bands}")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # Coefficients below 2**31 so a * x + b fits in 64 bits for x < 2**32
+        self.a = rng.integers(1, 2**31, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 2**31, num_perm, dtype=np.uint64)
+        self.buckets: list[dict[bytes, list[str]]] = [
+            defaultdict(list) for _ in range(bands)
+        ]
+        self.signatures: dict[str, np.ndarray] = {}
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature of the word shingles of a text."""
+        tokens = _TOKEN_PATTERN.findall(text.lower())
+        n_shingles = max(len(tokens) - self.shingle_size + 1, 1)
+        hashes = np.fromiter(
+            (
+                zlib.crc32(" ".join(tokens[i : i + self.shingle_size]).encode())
+                for i in range(n_shingles)
+            ),
+            dtype=np.uint64,
+            count=n_shingles,
+        )
+        permuted = (np.outer(self.a, hashes % _PRIME) + self.b[:, None]) % _PRIME
+        return permuted.min(axis=1)
+
+    def add(self, key: str, text: str) -> str | None:
+        """
+        Add a text unless it is a near duplicate of one already added.
+
+        Returns:
+        -------
+            str: The key of the near duplicate, or None if the text was added.
+
+        """
+        signature = self.signature(text)
+        bands = [
+            signature[i * self.rows : (i + 1) * self.rows].tobytes()
+            for i in range(self.bands)
+        ]
+        checked = set()
+        for band, band_key in zip(self.buckets, bands):
+            for candidate in band.get(band_key, []):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                similarity = np.mean(self.signatures[candidate] == signature)
+                if similarity >= self.threshold:
+                    return candidate
+        self.signatures[key] = signature
+        for band, band_key in zip(self.buckets, bands):
+            band[band_key].append(key)
+        return None
+
+
+def _add_duplicate_url(metadata: dict, url: str | None):
+    """Record the url of a dropped duplicate on the metadata of the kept copy."""
+    duplicate_urls = metadata.get("duplicate_urls", [])
+    if url and url != metadata.get("url") and url not in duplicate_urls:
+        metadata["duplicate_urls"] = duplicate_urls + [url]
+
+
+def deduplicate_documents(
+    documents: list[tuple[str, list[Document]]],
+    meta_lookup: dict[pathlib.Path, dict],
+    threshold: float = 0.9,
+) -> tuple[list[tuple[str, list[Document]]], dict[str, str]]:
+    """
+    Drop loaded documents that are near duplicates of an earlier document.
+
+    The urls of dropped documents are kept in the `duplicate_urls` metadata of
+    the document that was kept, so they end up on each of its chunks.
+
+    Returns:
+    -------
+        tuple: The kept documents and a mapping of dropped to kept sources.
+
+    """
+    index = NearDuplicateIndex(threshold=threshold)
+    kept = []
+    kept_by_source = {}
+    dropped = {}
+    for extension, document in documents:
+        source = document[0].metadata["source"]
+        text = "\n".join(page.page_content for page in document)
+        original = index.add(source, text)
+        if original is None:
+            kept.append((extension, document))
+            kept_by_source[source] = document
+            continue
+        dropped[source] = original
+        url = meta_lookup.get(pathlib.Path(source), {}).get("url")
+        for page in kept_by_source[original]:
+            _add_duplicate_url(page.metadata, url)
+    logger.info(f"Dropped {len(dropped)} near duplicate documents of {len(documents)}")
+    return kept, dropped
+
+
+def deduplicate_chunks(
+    chunks: list[Document], threshold: float = 0.9
+) -> list[Document]:
+    """Drop chunks that are near duplicates of an earlier chunk."""
+    index = NearDuplicateIndex(threshold=threshold)
+    kept = {}
+    for i, chunk in enumerate(chunks):
+        original = index.add(str(i), chunk.page_content)
+        if original is None:
+            kept[str(i)] = chunk
+        else:
+            _add_duplicate_url(kept[original].metadata, chunk.metadata.get("url"))
+    logger.info(
+        f"Dropped {len(chunks) - len(kept)} near duplicate chunks of {len(chunks)}"
+    )
+    return list(kept.values())
@@ -0,0 +1,73 @@
+"""Streamed downloads of knowledge source attachments."""
+
+import hashlib
+import logging
+import os
+import pathlib
+from typing import Iterable
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_ATTACHMENT_BYTES = 100 * 1024 * 1024
+
+
+class AttachmentTooLargeError(ValueError):
+    """Raised when an attachment is larger than the allowed size."""
+
+
+def write_chunks(
+    chunks: Iterable[bytes], path: pathlib.Path, max_bytes: int | None = None
+) -> dict:
+    """
+    Write chunks of a file to disk as they arrive, with a checksum.
+
+    The file is written next to `path` and only moved into place once it is
+    complete, so a failed or oversized download never leaves a partial file.
+
+    Returns:
+    -------
+        dict: The path, size in bytes and sha256 hex digest of the file.
+
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = path.with_name(path.name + ".part")
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with open(partial_path, "wb") as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise AttachmentTooLargeError(
+                        f"{path.name} is larger than {max_bytes} bytes"
+                    )
+                sha256.update(chunk)
+                f.write(chunk)
+        os.replace(partial_path, path)
+    finally:
+        partial_path.unlink(missing_ok=True)
+    return {"path": path, "size": size, "sha256": sha256.hexdigest()}
+
+
+def download(
+    session: requests.Session,
+    url: str,
+    path: pathlib.Path,
+    headers: dict | None = None,
+    max_bytes: int | None = MAX_ATTACHMENT_BYTES,
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+    timeout: float = 60,
+) -> dict:
+    """Stream a url to a file, holding at most one chunk in memory."""
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        # Fail before downloading when the server announces the size
+        content_length = response.headers.get("Content-Length")
+        if max_bytes is not None and content_length and int(content_length) > max_bytes:
+            raise AttachmentTooLargeError(
+                f"{path.name} is {content_length} bytes, more than {max_bytes}"
+            )
+        return write_chunks(response.iter_content(chunk_size), path, max_bytes)
@@ -0,0 +1,141 @@
+"""Multi-process CPU embeddings for large ingest runs."""
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Iterator
+
+from langchain_core.embeddings import Embeddings
+
+from constants import available_cpus
+
+logger = logging.getLogger(__name__)
+
+# The model loaded by each worker process
+_worker_embedder: Embeddings | None = None
+
+
+def _init_worker(model_name: str, backend: str, threads: int):
+    """Load a model copy limited to `threads` intra-op threads."""
+    global _worker_embedder
+    # Set before torch or onnxruntime are imported so their thread pools, and
+    # those of the BLAS libraries below them, start at the pinned size
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[variable] = str(threads)
+    # The workers already run in parallel, tokenizer threads would oversubscribe
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    if backend == "huggingface":
+        import torch
+
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+
+    from ingest_data import get_embedder
+
+    _worker_embedder = get_embedder(
+        model_name, backend=backend, threads=threads, show_progress=False, device="cpu"
+    )
+
+
+def _embed_batch(texts: list[str]) -> list[list[float]]:
+    return _worker_embedder.embed_documents(texts)
+
+
+class EmbeddingPool(Embeddings):
+    """
+    LangChain embeddings sharded across worker processes on CPU.
+
+    Each worker loads its own copy of the model and is pinned to
+    `threads_per_worker` intra-op threads, so the pool uses all the cores
+    without the workers competing for them. Texts are sent to the workers in
+    batches and the embeddings come back in the order of the texts.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        backend: str = "huggingface",
+        workers: int | None = None,
+        threads_per_worker: int | None = None,
+        batch_size: int = 128,
+    ):
+        """
+        Size the pool, the worker processes are started on first use.
+
+        Args:
+        ----
+            model_name (str): Embedding model each worker loads.
+            backend (str): Embedding backend, see `ingest_data.EMBEDDING_BACKENDS`.
+            workers (int): Number of worker processes. Defaults to the number of
+                usable cores divided by `threads_per_worker`.
+            threads_per_worker (int): Intra-op threads per worker. Defaults to
+                an even share of the usable cores.
+            batch_size (int): Number of texts sent to a worker at a time.
+
+        """
+        cpus = available_cpus()
+        if workers is None:
+            workers = max(1, cpus // (threads_per_worker or 1))
+        if threads_per_worker is None:
+            threads_per_worker = max(1, cpus // workers)
+        self.model_name = model_name
+        self.backend = backend
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.batch_size = batch_size
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            logger.info(
+                f"Starting {self.workers} embedding workers with "
+                f"{self.threads_per_worker} threads each"
+            )
+            # Spawned rather than forked, forking a process whose torch thread
+            # pool is already running can deadlock the children
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_name, self.backend, self.threads_per_worker),
+            )
+        return self._executor
+
+    def start(self):
+        """Start every worker and wait for its model to load."""
+        list(self.executor.map(_embed_batch, [["warm up"]] * self.workers))
+
+    def embed_batches(
+        self, texts: list[str], batch_size: int | None = None
+    ) -> Iterator[list[list[float]]]:
+        """
+        Yield the embeddings of consecutive batches of texts, in order.
+
+        All batches are queued at once, so the workers keep embedding while
+        the caller consumes, e.g. writes, the batches already done.
+        """
+        batch_size = batch_size or self.batch_size
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        return self.executor.map(_embed_batch, batches)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [
+            embedding for batch in self.embed_batches(texts) for embedding in batch
+        ]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.executor.submit(_embed_batch, [text]).result()[0]
+
+    def close(self):
+        """Stop the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self) -> "EmbeddingPool":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
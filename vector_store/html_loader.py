@@ -0,0 +1,186 @@
+"""HTML to text loader that keeps only the main content of a page."""
+
+import logging
+import pathlib
+import re
+
+import lxml.etree
+import lxml.html
+from langchain.docstore.document import Document
+from langchain_core.document_loaders import BaseLoader
+
+logger = logging.getLogger(__name__)
+
+# Elements that never hold page content
+_DROP_TAGS = [
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "svg",
+    "iframe",
+    "button",
+]
+# Page chrome, unless it is part of the main content region, e.g. the header
+# holding the title of an article
+_CHROME_TAGS = ["nav", "header", "footer", "aside"]
+_DROP_XPATH = (
+    "//*[@role='navigation' or @role='banner' or @role='contentinfo' "
+    "or @aria-hidden='true' or @hidden]"
+)
+# Whole class names or ids of navigation chrome, "has-sidebar" or "menu-item"
+# are not matched
+_BOILERPLATE_NAMES = {
+    "nav",
+    "navbar",
+    "menu",
+    "breadcrumb",
+    "breadcrumbs",
+    "sidebar",
+    "site-footer",
+    "site-header",
+    "cookie",
+    "cookies",
+}
+_MAIN_XPATHS = ["//main", "//*[@role='main']", "//article"]
+_BLOCK_TAGS = [
+    "p",
+    "div",
+    "section",
+    "li",
+    "tr",
+    "pre",
+    "blockquote",
+    "dt",
+    "dd",
+    "table",
+    "ul",
+    "ol",
+    "br",
+]
+_HEADING_TAGS = ["h1", "h2", "h3", "h4", "h5", "h6"]
+_CELL_TAGS = ["td", "th"]
+_SPACES_PATTERN = re.compile(r"[ \t\r\f\v\xa0]+")
+_BLANK_LINES_PATTERN = re.compile(r"\n\s*\n+")
+_XML_DECLARATION_PATTERN = re.compile(r"^\s*<\?xml[^>]*\?>")
+_TAG_PATTERN = re.compile(r"<[^>]*>")
+
+
+def _is_boilerplate(element) -> bool:
+    """Whether a class name or the id of an element marks navigation chrome."""
+    names = element.get("class", "").lower().split()
+    names.append(element.get("id", "").lower())
+    return not _BOILERPLATE_NAMES.isdisjoint(names)
+
+
+def _find_main(root):
+    """The main content region the page marks, if any, outside of its chrome."""
+    for xpath in _MAIN_XPATHS:
+        for element in root.xpath(xpath):
+            if not any(a.tag in _CHROME_TAGS for a in element.iterancestors()):
+                return element
+    return None
+
+
+def _normalize_whitespace(text: str) -> str:
+    lines = [_SPACES_PATTERN.sub(" ", line).strip() for line in text.split("\n")]
+    return _BLANK_LINES_PATTERN.sub("\n\n", "\n".join(lines)).strip()
+
+
+def html_to_text(html: str | bytes, encoding: str = "utf-8") -> tuple[str, str | None]:
+    """
+    Extract the visible main content of a page as markdown-like text.
+
+    Scripts, styles and navigation chrome are dropped, the main content region
+    is used when the page marks one, and headings are kept as markdown
+    headings so the markdown splitter can split on them. Pages that can't be
+    parsed as HTML fall back to their text with the tags removed.
+
+    Args:
+    ----
+        html (str | bytes): The page, bytes are decoded with `encoding`.
+        encoding (str): Encoding of the page when it is given as bytes.
+
+    Returns:
+    -------
+        tuple: The text and the page title, if any.
+
+    """
+    if isinstance(html, str):
+        # lxml rejects strings that declare their encoding, as XHTML pages do
+        html = _XML_DECLARATION_PATTERN.sub("", html)
+        parser = None
+    else:
+        parser = lxml.html.HTMLParser(encoding=encoding)
+    if not html.strip():
+        return "", None
+    try:
+        root = lxml.html.document_fromstring(html, parser=parser)
+    except (lxml.etree.ParserError, ValueError) as e:
+        # e.g. a page holding only comments
+        logger.warning(f"Could not parse HTML, keeping its text as is: {e}")
+        if isinstance(html, bytes):
+            html = html.decode(encoding, errors="replace")
+        return _normalize_whitespace(_TAG_PATTERN.sub(" ", html)), None
+    title = root.findtext(".//title")
+    title = title.strip() if title else None
+
+    for element in list(root.iter(_DROP_TAGS)):
+        element.drop_tree()
+    main = _find_main(root)
+    body = root.find("body")
+    body_length = len(body.text_content()) if body is not None else 0
+
+    def holds_content(element) -> bool:
+        """Whether an element is or wraps the main region, or holds most of the text."""
+        if main is not None and (element is main or element in main.iterancestors()):
+            return True
+        return len(element.text_content()) * 2 > body_length
+
+    for element in list(root.iter(_CHROME_TAGS)) + root.xpath(_DROP_XPATH):
+        in_main = main is not None and main in element.iterancestors()
+        if (element.tag in _CHROME_TAGS and in_main) or holds_content(element):
+            continue
+        element.drop_tree()
+    for element in root.xpath("//body//*[@class or @id]"):
+        if not _is_boilerplate(element):
+            continue
+        if element.tag in ("main", "article") or holds_content(element):
+            continue
+        element.drop_tree()
+
+    content = main if main is not None else root.find("body")
+    if content is None:
+        content = root
+
+    # Separate blocks with blank lines and prefix headings with markdown markers
+    for element in content.iter(_HEADING_TAGS):
+        level = int(element.tag[1])
+        element.text = "\n\n" + "#" * level + " " + (element.text or "").lstrip()
+        element.tail = "\n\n" + (element.tail or "")
+    for element in content.iter(_BLOCK_TAGS):
+        element.tail = "\n\n" + (element.tail or "")
+    # Separate the cells of a row
+    for element in content.iter(_CELL_TAGS):
+        previous = element.getprevious()
+        if previous is not None and previous.tag in _CELL_TAGS:
+            element.text = " | " + (element.text or "")
+
+    return _normalize_whitespace(content.text_content()), title
+
+
+class HTMLTextLoader(BaseLoader):
+    """Load an HTML file as the text of its main content."""
+
+    def __init__(self, file_path: str | pathlib.Path, encoding: str = "utf-8"):
+        self.file_path = file_path
+        self.encoding = encoding
+
+    def load(self) -> list[Document]:
+        # Read as bytes so pages starting with an XML declaration parse too
+        with open(self.file_path, "rb") as f:
+            text, title = html_to_text(f.read(), encoding=self.encoding)
+        metadata = {"source": str(self.file_path)}
+        if title:
+            metadata["title"] = title
+        return [Document(page_content=text, metadata=metadata)]
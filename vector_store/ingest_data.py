@@ -1,15 +1,16 @@
 """Data Ingestion"""
 
+import csv
 import logging
 import pathlib
+from collections import Counter
 from datetime import datetime
 
-import pandas as pd
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
-from langchain_postgres import PGVector
+from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import InMemoryVectorStore, VectorStore
 
 from constants import (
-    DEVICE,
     DIRECTORY_PATH,
     KNOWLEDGE_REPOSITORY_PATH,
     PGVECTOR_DATABASE_NAME,
@@ -17,60 +18,64 @@ from constants import (
     PGVECTOR_PASS,
     PGVECTOR_PORT,
     PGVECTOR_USER,
+    get_device,
 )
-from split import load_documents, split_document
+from dedup import deduplicate_chunks, deduplicate_documents
+from embedding_pool import EmbeddingPool
+from profiling import StageProfiler
+from split import get_token_window, load_documents, split_documents
 
 logger = logging.getLogger(__name__)
 
 
-def get_embedder(embedding_model_name: str) -> HuggingFaceEmbeddings:
+EMBEDDING_BACKENDS = ["huggingface", "onnx", "onnx-int8"]
+
+
+def get_embedder(
+    embedding_model_name: str,
+    backend: str = "huggingface",
+    threads: int | None = None,
+    show_progress: bool = True,
+    device: str | None = None,
+) -> Embeddings:
     """Initialize an embedder to convert text into vectors."""
-    return HuggingFaceEmbeddings(
-        model_name=embedding_model_name,
-        model_kwargs={"device": DEVICE},
-        show_progress=True,
+    if backend == "huggingface":
+        # Imported here as it loads torch and transformers
+        from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+
+        return HuggingFaceEmbeddings(
+            model_name=embedding_model_name,
+            model_kwargs={"device": device or get_device()},
+            show_progress=show_progress,
+        )
+    if backend in ("onnx", "onnx-int8"):
+        # Imported here so the default backend doesn't require onnxruntime
+        from onnx_embeddings import OnnxEmbeddings
+
+        return OnnxEmbeddings(
+            model_name=embedding_model_name,
+            quantize=backend == "onnx-int8",
+            threads=threads,
+        )
+    raise ValueError(
+        f"Unknown embedding backend {backend}, expected one of {EMBEDDING_BACKENDS}"
     )
 
 
-def ingest(
-    meta_lookup: dict[pathlib.Path, dict],
+def get_vectorstore(
     collection_name: str,
-    chunk_size: int,
-    chunk_overlap: int,
-    ingest_threads: int = 8,
-    embedding_model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
-    mode: str = "overwrite",
+    embedder,
     collection_metadata: dict = {},
-):
-    """Load documents into a vectorstore."""
-    # Get documents
-    all_documents = []
-    origin_urls = {}
-    documents = load_documents(KNOWLEDGE_REPOSITORY_PATH, ingest_threads=ingest_threads)
-    for extension, document in documents:
-        # Split each document into chunks
-        document = document[0]
-        # Rename "source" to "_source" and save filename to "source"
-        source = pathlib.Path(document.metadata["source"])
-        file_name = source.stem
-        document.metadata["_source"] = document.metadata["source"]
-        document.metadata["source"] = file_name
-        chunks = split_document(
-            document, extension, chunk_size=chunk_size, chunk_overlap=chunk_overlap
-        )
-        # Attach metadata to each chunk
-        for chunk in chunks:
-            path_metadata = meta_lookup.get(source, {})
-            chunk.metadata = chunk.metadata | path_metadata
-        # Record how many chunks were made
-        rel_path = source.relative_to(KNOWLEDGE_REPOSITORY_PATH)
-        origin = rel_path.parts[0]
-        origin_url = (origin, chunk.metadata.get("url"))
-        origin_urls[origin_url] = len(chunks)
-        all_documents.extend(chunks)
-
-    # Create embeddings
-    embedder = get_embedder(embedding_model_name)
+    store: str = "pgvector",
+) -> VectorStore:
+    """Connect to the vector store a collection is written to."""
+    # An in-process store, used for dry runs and benchmarks
+    if store == "memory":
+        return InMemoryVectorStore(embedding=embedder)
+    if store != "pgvector":
+        raise ValueError(f"Unknown vector store {store}")
+    # Imported here so the in-memory store works without Postgres drivers
+    from langchain_postgres import PGVector
 
     # Build the Postgres connection string
     connection_string = PGVector.connection_string_from_db_params(
@@ -83,7 +88,7 @@ def ingest(
     )
 
     # Connect to the db
-    db = PGVector(
+    return PGVector(
         connection=connection_string,
         embeddings=embedder,
         collection_name=collection_name,
@@ -91,32 +96,247 @@ def ingest(
         use_jsonb=True,
     )
 
-    # Overwrite the collection (if requested)
-    if mode == "overwrite":
-        db.delete_collection()
-        logger.info(f"Collection {collection_name} deleted")
-        db.create_collection()
-        logger.info(f"Collection {collection_name} created")
 
-    # Load the documents
-    logger.info(
-        f"Loading {len(all_documents)} embeddings to {PGVECTOR_HOST} - {PGVECTOR_DATABASE_NAME} - {collection_name}"
+def chunk_documents(
+    documents: list[tuple[str, list[Document]]],
+    meta_lookup: dict[pathlib.Path, dict],
+    chunk_size: int,
+    chunk_overlap: int,
+    source_dir: pathlib.Path = KNOWLEDGE_REPOSITORY_PATH,
+    tokenizer_name: str | None = None,
+    split_workers: int = 1,
+) -> tuple[list[Document], dict[tuple[str, str], int]]:
+    """Split loaded documents into chunks carrying their source metadata."""
+    to_split = []
+    for extension, document in documents:
+        document = document[0]
+        # Rename "source" to "_source" and save filename to "source"
+        source = pathlib.Path(document.metadata["source"])
+        file_name = source.stem
+        document.metadata["_source"] = document.metadata["source"]
+        document.metadata["source"] = file_name
+        to_split.append((extension, document))
+
+    # Split each document into chunks
+    split = split_documents(
+        to_split,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        tokenizer_name=tokenizer_name,
+        workers=split_workers,
     )
 
+    all_documents = []
+    origin_urls = {}
+    for (extension, document), chunks in zip(to_split, split):
+        # Attach metadata to each chunk, including the partition keys used to
+        # filter queries
+        source = pathlib.Path(document.metadata["_source"])
+        rel_path = source.relative_to(source_dir)
+        origin = rel_path.parts[0]
+        path_metadata = meta_lookup.get(source, {})
+        partition_metadata = {"origin": origin, "file_type": extension}
+        for chunk in chunks:
+            chunk.metadata = chunk.metadata | partition_metadata | path_metadata
+        # Record how many chunks were made
+        origin_url = (origin, path_metadata.get("url"))
+        origin_urls[origin_url] = len(chunks)
+        all_documents.extend(chunks)
+    return all_documents, origin_urls
+
+
+def write_documents(
+    db: VectorStore,
+    documents: list[Document],
+    batch_size: int = 150,
+    pool: EmbeddingPool | None = None,
+):
+    """Embed and add documents to the vector store in batches."""
+    if pool is not None and hasattr(db, "add_embeddings"):
+        # The pool embeds the following batches while each one is written
+        texts = [document.page_content for document in documents]
+        metadatas = [document.metadata for document in documents]
+        batches = pool.embed_batches(texts, batch_size=batch_size)
+        for i, embeddings in zip(range(0, len(documents), batch_size), batches):
+            logger.info(
+                f"Ingesting batch {i // batch_size + 1} of {len(embeddings)} documents"
+            )
+            db.add_embeddings(
+                texts=texts[i:i + batch_size],
+                embeddings=embeddings,
+                metadatas=metadatas[i:i + batch_size],
+            )
+        return
+
     # Add documents to DB in batches to accomodate the large numbers of parameters
-    batch_size = 150
-    for i in range(0, len(all_documents), batch_size):
-        batch = all_documents[i:i + batch_size]
+    for i in range(0, len(documents), batch_size):
+        batch = documents[i:i + batch_size]
         logger.info(f"Ingesting batch {i // batch_size + 1} of {len(batch)} documents")
         db.add_documents(documents=batch)
 
-    logger.info(f"Successfully loaded {len(all_documents)} embeddings")
+
+def ingest(
+    meta_lookup: dict[pathlib.Path, dict],
+    collection_name: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    ingest_threads: int = 8,
+    chunk_unit: str = "characters",
+    embedding_model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+    embedding_backend: str = "huggingface",
+    embedding_workers: int = 1,
+    mode: str = "overwrite",
+    collection_metadata: dict = {},
+    source_dir: pathlib.Path = KNOWLEDGE_REPOSITORY_PATH,
+    store: str = "pgvector",
+    dedup: bool = False,
+    dedup_threshold: float = 0.9,
+    ann_index: dict | None = None,
+    profiler: StageProfiler | None = None,
+) -> dict[str, int]:
+    """
+    Load documents into a vectorstore, profiling each stage if requested.
+
+    With `embedding_workers` other than 1, chunks are embedded on CPU by a pool
+    of that many processes, 0 sizing the pool to the usable cores.
+    """
+    profiler = profiler or StageProfiler()
+
+    # Get documents
+    with profiler.stage(f"{collection_name}-load"):
+        documents = load_documents(source_dir, ingest_threads=ingest_threads)
+    n_documents = len(documents)
+
+    # Drop near duplicate documents before they are split
+    dropped_documents = {}
+    if dedup:
+        with profiler.stage(f"{collection_name}-dedup_documents"):
+            documents, dropped_documents = deduplicate_documents(
+                documents, meta_lookup, threshold=dedup_threshold
+            )
+
+    # Chunks measured in tokens of the embedding model fill its token window
+    if chunk_unit not in ("characters", "tokens"):
+        raise ValueError(f"Unknown chunk unit {chunk_unit}")
+    if chunk_unit == "tokens":
+        # Longer chunks would be silently truncated when they are embedded
+        window = get_token_window(embedding_model_name)
+        if window is not None and chunk_size > window:
+            clamped_overlap = chunk_overlap * window // chunk_size
+            logger.warning(
+                f"chunk_size {chunk_size} is more than the {window} tokens "
+                f"{embedding_model_name} embeds, using chunk_size {window} and "
+                f"chunk_overlap {clamped_overlap}"
+            )
+            chunk_size, chunk_overlap = window, clamped_overlap
+    with profiler.stage(f"{collection_name}-split"):
+        all_documents, origin_urls = chunk_documents(
+            documents,
+            meta_lookup,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            source_dir=source_dir,
+            tokenizer_name=embedding_model_name if chunk_unit == "tokens" else None,
+            split_workers=ingest_threads,
+        )
+
+    # Drop near duplicate chunks before they are embedded
+    embeddings_avoided = 0
+    if dedup:
+        # A dropped document would have been split like the copy that was kept
+        chunks_per_source = Counter(chunk.metadata["_source"] for chunk in all_documents)
+        embeddings_avoided = sum(
+            chunks_per_source[original] for original in dropped_documents.values()
+        )
+        n_chunks = len(all_documents)
+        with profiler.stage(f"{collection_name}-dedup_chunks"):
+            all_documents = deduplicate_chunks(all_documents, threshold=dedup_threshold)
+        embeddings_avoided += n_chunks - len(all_documents)
+        logger.info(
+            f"Deduplication avoided {embeddings_avoided} embeddings "
+            f"({len(dropped_documents)} documents, {n_chunks - len(all_documents)} chunks)"
+        )
+    for chunk in all_documents:
+        chunk.metadata["collection"] = collection_name
+
+    # Embeddings are created as the documents are written, so both are
+    # profiled as one stage
+    with profiler.stage(f"{collection_name}-embed_write"):
+        # Create embeddings
+        pool = None
+        if embedding_workers != 1:
+            pool = EmbeddingPool(
+                embedding_model_name,
+                backend=embedding_backend,
+                workers=embedding_workers or None,
+            )
+            embedder = pool
+        else:
+            embedder = get_embedder(embedding_model_name, backend=embedding_backend)
+
+        db = get_vectorstore(
+            collection_name, embedder, collection_metadata=collection_metadata, store=store
+        )
+
+        # Overwrite the collection (if requested)
+        if mode == "overwrite" and store == "pgvector":
+            db.delete_collection()
+            logger.info(f"Collection {collection_name} deleted")
+            db.create_collection()
+            logger.info(f"Collection {collection_name} created")
+
+        # Load the documents
+        logger.info(
+            f"Loading {len(all_documents)} embeddings to {PGVECTOR_HOST} - {PGVECTOR_DATABASE_NAME} - {collection_name}"
+        )
+        try:
+            write_documents(db, all_documents, pool=pool)
+        finally:
+            if pool is not None:
+                pool.close()
+        logger.info(f"Successfully loaded {len(all_documents)} embeddings")
+
+    # Build the ANN index once the bulk load is done, which is much faster
+    # than maintaining it row by row during the load
+    if ann_index and store == "pgvector":
+        import psycopg
+
+        from pgvector_index import create_ann_index, pgvector_conninfo
+
+        conninfo = pgvector_conninfo(
+            host=PGVECTOR_HOST,
+            port=int(PGVECTOR_PORT),
+            database=PGVECTOR_DATABASE_NAME,
+            user=PGVECTOR_USER,
+            password=PGVECTOR_PASS,
+        )
+        with profiler.stage(f"{collection_name}-ann_index"), psycopg.connect(
+            conninfo, autocommit=True
+        ) as conn:
+            create_ann_index(
+                conn,
+                collection_name,
+                index_type=ann_index.get("type", "hnsw"),
+                m=ann_index.get("m", 16),
+                ef_construction=ann_index.get("ef_construction", 64),
+                lists=ann_index.get("lists"),
+                recreate=mode == "overwrite",
+                maintenance_work_mem=ann_index.get("maintenance_work_mem"),
+            )
 
     directory_source_url_chunks = [
         list(origin_url) + [chunks] for origin_url, chunks in origin_urls.items()
     ]
-    df = pd.DataFrame(directory_source_url_chunks, columns=["origin", "url", "chunks"])
     filename = f"{PGVECTOR_HOST} - {collection_name} - {datetime.now()}.csv"
     outpath = DIRECTORY_PATH / "logs" / filename
     outpath.parent.mkdir(parents=True, exist_ok=True)
-    df.to_csv(outpath, index=False)
+    with outpath.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["origin", "url", "chunks"])
+        writer.writerows(directory_source_url_chunks)
+
+    return {
+        "documents": n_documents,
+        "chunks": len(all_documents),
+        "embeddings_avoided": embeddings_avoided,
+    }
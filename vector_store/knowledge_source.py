@@ -4,11 +4,15 @@ import pathlib
 import time
 import logging
 from typing import Any
+from urllib.parse import unquote, urljoin, urlparse
+
+import requests
 from bs4 import BeautifulSoup
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 
 from constants import SOURCE_RESPOSITORY_PATH
+from downloads import MAX_ATTACHMENT_BYTES, download
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +23,8 @@ class SourceScraper:
         chrome_options.add_argument("--start-maximized")
         self.driver = webdriver.Chrome(options=chrome_options)
         self.base_url = base_url
+        # sha256 of each downloaded attachment -> its path
+        self.checksums: dict[str, pathlib.Path] = {}
 
         self.driver.get(self.base_url)
         print("\n Please log in manually and press ENTER here once done...")
@@ -65,20 +71,52 @@ class SourceScraper:
         with open(path, "w", encoding="utf-8") as f:
             f.write(str(soup))
 
-    def download_attachments(self, attachments: list[str], base_path: pathlib.Path):
+    def _http_session(self) -> requests.Session:
+        """A requests session sharing the logged in browser's cookies."""
+        session = requests.Session()
+        session.headers["User-Agent"] = self.driver.execute_script(
+            "return navigator.userAgent"
+        )
+        for cookie in self.driver.get_cookies():
+            session.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie.get("domain"),
+                path=cookie.get("path", "/"),
+            )
+        return session
+
+    def download_attachments(
+        self,
+        attachments: list[str],
+        base_path: pathlib.Path,
+        max_bytes: int | None = MAX_ATTACHMENT_BYTES,
+    ) -> list[dict]:
+        """
+        Stream attachments to disk, skipping files already downloaded.
+
+        Returns:
+        -------
+            list: The url, path, size and sha256 checksum of each new file.
+
+        """
+        session = self._http_session()
+        downloaded = []
         for link in attachments:
-            file_name = link.split("/")[-1]
-            full_path = base_path / file_name
+            url = urljoin(self.base_url, link)
+            file_name = unquote(pathlib.PurePosixPath(urlparse(url).path).name)
             try:
-                self.driver.get(
-                    link
-                    if link.startswith("http")
-                    else self.base_url.rstrip("/") + link
-                )
-                with open(full_path, "wb") as f:
-                    f.write(self.driver.page_source.encode("utf-8"))
+                result = download(session, url, base_path / file_name, max_bytes=max_bytes)
             except Exception as e:
                 logger.warning(f"Failed to download attachment {link}: {e}")
+                continue
+            # The same file linked from several pages is only kept once
+            kept_path = self.checksums.setdefault(result["sha256"], result["path"])
+            if kept_path != result["path"]:
+                result["path"].unlink(missing_ok=True)
+                continue
+            downloaded.append(result | {"url": url})
+        return downloaded
 
     def scrape(
         self,
@@ -86,6 +124,7 @@ class SourceScraper:
         recursive: bool,
         attachments: bool,
         metadata: dict[str, Any],
+        max_attachment_bytes: int | None = MAX_ATTACHMENT_BYTES,
     ):
         meta_lookup = {}
         pages = self.fetch_all_pages(url_fragment, recursive)
@@ -104,7 +143,14 @@ class SourceScraper:
 
             if attachments:
                 attachment_links = self.extract_attachments(soup)
-                self.download_attachments(attachment_links, page_path.parent)
+                for attachment in self.download_attachments(
+                    attachment_links, page_path.parent, max_bytes=max_attachment_bytes
+                ):
+                    meta_lookup[attachment["path"]] = metadata | {
+                        "url": attachment["url"],
+                        "size": attachment["size"],
+                        "sha256": attachment["sha256"],
+                    }
 
             meta_lookup[page_path] = file_metadata
 
@@ -116,7 +162,10 @@ def fetchall(
     recursive: bool = False,
     attachments: bool = True,
     metadata: dict = {},
+    max_attachment_bytes: int | None = MAX_ATTACHMENT_BYTES,
     **kwargs,
 ):
     scraper = SourceScraper()
-    return scraper.scrape(url_fragment, recursive, attachments, metadata)
+    return scraper.scrape(
+        url_fragment, recursive, attachments, metadata, max_attachment_bytes
+    )
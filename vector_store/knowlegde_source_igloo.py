@@ -1,13 +1,24 @@
 import logging
 import os
+import pathlib
 
 import pyigloo
 
 from constants import SOURCE_RESPOSITORY_PATH
+from downloads import MAX_ATTACHMENT_BYTES, AttachmentTooLargeError, download
 
 logger = logging.getLogger(__name__)
 
 
+def document_path(document: dict) -> pathlib.Path:
+    """Local path of a page or attachment, following its URL path."""
+    doc_href: str = document.get("attachedToHref", document["href"])
+    extension = document.get("fileExtension", ".html")
+    doc_title: str = document["title"].replace(extension, "")
+    doc_path = doc_href.lstrip("/") + "/" + doc_title + extension
+    return SOURCE_RESPOSITORY_PATH / doc_path
+
+
 class Igloo:
     """Class for connecting to igloo."""
 
@@ -72,18 +83,32 @@ class Igloo:
 
         return all_children
 
-    def get_document_binary(self, document_id: str) -> bytes:
-        """Get the contents of a document."""
+    def download_document_binary(
+        self,
+        document_id: str,
+        path: pathlib.Path,
+        max_bytes: int | None = MAX_ATTACHMENT_BYTES,
+    ) -> dict:
+        """Stream the contents of a document to a file."""
         # Send a request to the /documents/document_id/view_binary endpoint to get file contents
         endpoint = self.session.endpoint
         api_root = self.session.IGLOO_API_ROOT_V1
         url = "{0}{1}/documents/{2}/view_binary".format(endpoint, api_root, document_id)
         headers = {b"Accept": "application/json"}
-        response = self.session.igloo.get(url=url, headers=headers)
-        return response.content
-
-    def get_attachments(self, object_id: str):
-        """Get all attachments on an object."""
+        return download(
+            self.session.igloo, url, path, headers=headers, max_bytes=max_bytes
+        )
+
+    def get_attachments(
+        self, object_id: str, max_bytes: int | None = MAX_ATTACHMENT_BYTES
+    ) -> list[dict]:
+        """
+        Download all attachments on an object.
+
+        Each attachment is streamed to its local path as it is fetched, so
+        only its metadata, path, size and sha256 checksum are kept in memory.
+        Attachments larger than `max_bytes` are skipped.
+        """
         # Get page metadata
         page = self.get_object(object_id=object_id)
         # List the attachments
@@ -94,12 +119,25 @@ class Igloo:
         for item in items:
             document_id = item["ToId"]
             document_metadata = self.session.objects_view(document_id)
-            document_binary = self.get_document_binary(document_id=document_id)
-            attachment = document_metadata | {
-                "contentBinary": document_binary,
-                "attachedToHref": page["href"],
-            }
-            attachments.append(attachment)
+            attachment = document_metadata | {"attachedToHref": page["href"]}
+            if not attachment["isPublished"] or attachment["IsArchived"]:
+                continue
+            path = document_path(attachment)
+            try:
+                downloaded = self.download_document_binary(
+                    document_id=document_id, path=path, max_bytes=max_bytes
+                )
+            except AttachmentTooLargeError as e:
+                logger.warning(f"Skipping attachment {document_id}: {e}")
+                continue
+            attachments.append(
+                attachment
+                | {
+                    "contentPath": downloaded["path"],
+                    "size": downloaded["size"],
+                    "sha256": downloaded["sha256"],
+                }
+            )
         return attachments
 
 
@@ -108,6 +146,7 @@ def fetchall(
     recursive: bool = False,
     attachments: bool = True,
     metadata: dict = {},
+    max_attachment_bytes: int | None = MAX_ATTACHMENT_BYTES,
     **kwargs,
 ):
     """
@@ -121,6 +160,8 @@ def fetchall(
         recursive (bool): Whether or not to recurse into child pages. Defaults to False.
         attachments (bool): Whether or not to fetch page attachments. Defaults to True.
         metadata (dict): Metadata to attach to each page chunk. Defaults to {}.
+        max_attachment_bytes (int): Skip attachments larger than this. Defaults
+            to 100 MB, None for no limit.
         **kwargs: Additional arguments not used.
 
     """
@@ -134,36 +175,40 @@ def fetchall(
         parent_path=url_fragment, recursive=recursive
     )
 
-    # Fetch all attachments
+    # Fetch all attachments, downloading them to disk as they are fetched
+    attachment_documents = []
     if attachments:
+        kept_paths = {}
         for document in fragment_documents:
             object_id = document["id"]
-            object_attachments = igloo.get_attachments(object_id=object_id)
-            fragment_documents += object_attachments
+            for attachment in igloo.get_attachments(
+                object_id=object_id, max_bytes=max_attachment_bytes
+            ):
+                # The same file attached to several pages is only kept once
+                path = attachment["contentPath"]
+                kept_path = kept_paths.setdefault(attachment["sha256"], path)
+                if kept_path != path:
+                    path.unlink(missing_ok=True)
+                    continue
+                attachment_documents.append(attachment)
 
     # Convert to files and save locally
     meta_lookup = {}
-    for document in fragment_documents:
+    for document in fragment_documents + attachment_documents:
         if document["isPublished"] and not document["IsArchived"]:
             # Write the document in it's URL path locally
             doc_href: str = document.get("attachedToHref", document["href"])
-            extension = document.get("fileExtension", ".html")
-            doc_title: str = document["title"].replace(extension, "")
-            doc_path = doc_href.lstrip("/") + "/" + doc_title + extension
-            path = SOURCE_RESPOSITORY_PATH / doc_path
+            path = document_path(document)
             folder_path = path.parent
-            if document["content"].strip() != "" or "contentBinary" in document:
+            # Attachments are already on disk
+            if "contentPath" not in document and document["content"].strip() != "":
                 if not os.path.exists(folder_path):
                     os.makedirs(folder_path)
-                if "contentBinary" in document:
-                    with open(path, "wb") as f:
-                        f.write(document["contentBinary"])
-                else:
-                    with open(path, "w") as f:
-                        f.write(document["content"])
+                with open(path, "w") as f:
+                    f.write(document["content"])
 
             # Save metadata
-            used_columns = ["content", "contentBinary"]
+            used_columns = ["content", "contentPath"]
             file_metadata = {
                 key: value for key, value in document.items() if key not in used_columns
             }
@@ -0,0 +1,152 @@
+"""Local CPU embeddings with ONNX Runtime."""
+
+import logging
+import os
+import pathlib
+import tempfile
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from constants import available_cpus
+
+logger = logging.getLogger(__name__)
+
+ONNX_CACHE_PATH = pathlib.Path.home() / ".cache" / "agentic-chatbot" / "onnx"
+
+
+def resolve_model_name(model_name: str) -> str:
+    """Expand short sentence-transformers names such as 'all-MiniLM-L6-v2'."""
+    if "/" not in model_name:
+        return f"sentence-transformers/{model_name}"
+    return model_name
+
+
+class OnnxEmbeddingModel:
+    """Mean-pooled sentence-transformers embeddings computed with ONNX Runtime."""
+
+    def __init__(
+        self,
+        model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+        quantize: bool = False,
+        batch_size: int = 64,
+        max_length: int = 256,
+        threads: int | None = None,
+        normalize: bool = True,
+    ):
+        """
+        Load the tokenizer and ONNX graph of a sentence-transformers model.
+
+        Args:
+        ----
+            model_name (str): Hugging Face model id, it must ship an `onnx/model.onnx` export.
+            quantize (bool): Whether to dynamically quantize the weights to int8. The
+                quantized model is cached under ~/.cache/agentic-chatbot/onnx.
+            batch_size (int): Maximum number of texts per inference call.
+            max_length (int): Number of tokens texts are truncated to.
+            threads (int): Intra-op threads. Defaults to the number of usable cores.
+            normalize (bool): Whether to L2 normalize the embeddings.
+
+        """
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_name = resolve_model_name(model_name)
+        self.quantize = quantize
+        self.batch_size = batch_size
+        self.normalize = normalize
+
+        self.tokenizer = Tokenizer.from_pretrained(self.model_name)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or available_cpus()
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        model_path = self._model_path()
+        logger.info(
+            f"Loading {model_path} with {options.intra_op_num_threads} threads"
+        )
+        self.session = ort.InferenceSession(
+            str(model_path), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _model_path(self) -> pathlib.Path:
+        """Download the ONNX export and quantize it if requested."""
+        from huggingface_hub import hf_hub_download
+
+        model_path = pathlib.Path(hf_hub_download(self.model_name, "onnx/model.onnx"))
+        if not self.quantize:
+            return model_path
+
+        quantized_path = (
+            ONNX_CACHE_PATH / self.model_name.replace("/", "--") / "model_int8.onnx"
+        )
+        if not quantized_path.exists():
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            logger.info(f"Quantizing {model_path} to {quantized_path}")
+            quantized_path.parent.mkdir(parents=True, exist_ok=True)
+            # Processes loading the model at the same time, e.g. the workers of
+            # an EmbeddingPool, each quantize to their own file and the model
+            # is only moved into place once complete
+            with tempfile.TemporaryDirectory(dir=quantized_path.parent) as tmp_dir:
+                tmp_path = pathlib.Path(tmp_dir) / quantized_path.name
+                quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QInt8)
+                os.replace(tmp_path, quantized_path)
+        return quantized_path
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        """Embed a single batch of texts."""
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array(
+            [encoding.attention_mask for encoding in encodings], dtype=np.int64
+        )
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feed["token_type_ids"] = np.array(
+                [encoding.type_ids for encoding in encodings], dtype=np.int64
+            )
+        hidden_states = self.session.run(None, feed)[0]
+
+        # Mean pool over the real (non padding) tokens
+        mask = attention_mask[..., None].astype(np.float32)
+        embeddings = (hidden_states * mask).sum(axis=1) / np.clip(
+            mask.sum(axis=1), 1e-9, None
+        )
+        if self.normalize:
+            embeddings /= np.clip(
+                np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None
+            )
+        return embeddings.astype(np.float32)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Embed texts in batches of similar length to minimize padding."""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        order = np.argsort([len(text) for text in texts])[::-1]
+        embeddings = None
+        for start in range(0, len(texts), self.batch_size):
+            indices = order[start : start + self.batch_size]
+            batch = self._encode([texts[i] for i in indices])
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            embeddings[indices] = batch
+        return embeddings
+
+
+class OnnxEmbeddings(Embeddings):
+    """LangChain embeddings backed by an `OnnxEmbeddingModel`."""
+
+    def __init__(self, **kwargs):
+        self.model = OnnxEmbeddingModel(**kwargs)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.model.embed(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.model.embed([text])[0].tolist()
@@ -0,0 +1,133 @@
+"""Vector index partitioned by chunk metadata."""
+
+import logging
+import pathlib
+from collections import defaultdict
+
+import numpy as np
+
+from quantized_index import QuantizedIndex
+
+logger = logging.getLogger(__name__)
+
+PARTITION_FIELDS = ["origin", "department", "collection", "file_type"]
+
+
+class PartitionedIndex:
+    """
+    A `QuantizedIndex` with row lists per metadata value.
+
+    Every value of the partition fields maps to the sorted rows holding it, so
+    a filtered query only scans the rows of the matching partitions instead of
+    post-filtering the results of a global search.
+    """
+
+    def __init__(
+        self,
+        index: QuantizedIndex,
+        partitions: dict[str, dict[str, np.ndarray]],
+    ):
+        self.index = index
+        self.partitions = partitions
+
+    @classmethod
+    def from_metadata(
+        cls,
+        index: QuantizedIndex,
+        metadata: list[dict],
+        fields: list[str] = PARTITION_FIELDS,
+    ) -> "PartitionedIndex":
+        """Build the partitions from the metadata of each row of the index."""
+        rows = {field: defaultdict(list) for field in fields}
+        for row, row_metadata in enumerate(metadata):
+            for field in fields:
+                value = row_metadata.get(field)
+                if value is not None:
+                    rows[field][str(value)].append(row)
+        partitions = {
+            field: {
+                value: np.array(value_rows, dtype=np.int64)
+                for value, value_rows in values.items()
+            }
+            for field, values in rows.items()
+        }
+        return cls(index, partitions)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def rows_for(self, filters: dict[str, str | list[str]] | None) -> np.ndarray | None:
+        """
+        Rows matching all the filters, or None to search every row.
+
+        Values of a field are OR-ed together, fields are AND-ed.
+        """
+        if not filters:
+            return None
+        rows = None
+        for field, values in filters.items():
+            if field not in self.partitions:
+                raise ValueError(
+                    f"Cannot filter on {field}, expected one of {list(self.partitions)}"
+                )
+            if isinstance(values, str):
+                values = [values]
+            field_rows = [
+                self.partitions[field][value]
+                for value in values
+                if value in self.partitions[field]
+            ]
+            if not field_rows:
+                field_rows = np.empty(0, dtype=np.int64)
+            elif len(field_rows) == 1:
+                # Partition rows are already sorted and unique
+                field_rows = field_rows[0]
+            else:
+                field_rows = np.unique(np.concatenate(field_rows))
+            rows = (
+                field_rows
+                if rows is None
+                else np.intersect1d(rows, field_rows, assume_unique=True)
+            )
+        return rows
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int = 10,
+        filters: dict[str, str | list[str]] | None = None,
+    ) -> list[list[tuple[str, float]]]:
+        """Find the k nearest vectors of each query within the filtered partitions."""
+        rows = self.rows_for(filters)
+        # Rows are unique, so a filter matching as many rows as the index
+        # matches all of them and a full scan avoids gathering a copy
+        if rows is not None and len(rows) == len(self):
+            rows = None
+        return self.index.search(queries, k=k, rows=rows)
+
+    def save(self, path: pathlib.Path):
+        """Write the index and its partitions to a folder."""
+        self.index.save(path)
+        np.savez(
+            path / "partitions.npz",
+            **{
+                f"{field}={value}": rows
+                for field, values in self.partitions.items()
+                for value, rows in values.items()
+            },
+        )
+
+    @classmethod
+    def load(
+        cls, path: pathlib.Path, rescore_factor: int | None = None
+    ) -> "PartitionedIndex":
+        """Load an index and its partitions."""
+        partitions: dict[str, dict[str, np.ndarray]] = {
+            field: {} for field in PARTITION_FIELDS
+        }
+        with np.load(path / "partitions.npz") as saved:
+            for key in saved.files:
+                field, _, value = key.partition("=")
+                partitions.setdefault(field, {})[value] = saved[key]
+        index = QuantizedIndex.load(path, rescore_factor=rescore_factor)
+        return cls(index, partitions)
@@ -0,0 +1,205 @@
+"""ANN indexes and similarity queries on the PGVector collections."""
+
+import json
+import logging
+import math
+import re
+
+from psycopg import Connection, sql
+from psycopg.conninfo import make_conninfo
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ["hnsw", "ivfflat"]
+EMBEDDING_TABLE = "langchain_pg_embedding"
+COLLECTION_TABLE = "langchain_pg_collection"
+
+
+def pgvector_conninfo(
+    host: str, port: int, database: str, user: str, password: str
+) -> str:
+    """Build a psycopg connection string."""
+    return make_conninfo(
+        host=host, port=port, dbname=database, user=user, password=password
+    )
+
+
+# Lookups shared with the async retriever of the agent service
+COLLECTION_ID_QUERY = sql.SQL("SELECT uuid FROM {} WHERE name = %s").format(
+    sql.Identifier(COLLECTION_TABLE)
+)
+DIMENSIONS_QUERY = sql.SQL(
+    "SELECT vector_dims(embedding) FROM {} WHERE collection_id = %s LIMIT 1"
+).format(sql.Identifier(EMBEDDING_TABLE))
+
+
+def get_collection_id(conn: Connection, collection_name: str) -> str:
+    """Look up the uuid of a collection by name."""
+    row = conn.execute(COLLECTION_ID_QUERY, (collection_name,)).fetchone()
+    if row is None:
+        raise ValueError(f"Collection {collection_name} does not exist")
+    return str(row[0])
+
+
+def get_dimensions(conn: Connection, collection_id: str) -> int | None:
+    """Dimensions of the embeddings of a collection, None if it is empty."""
+    row = conn.execute(DIMENSIONS_QUERY, (collection_id,)).fetchone()
+    return None if row is None else row[0]
+
+
+def ann_index_name(collection_name: str, index_type: str) -> str:
+    """Name of the ANN index of a collection."""
+    safe_name = re.sub(r"\W", "_", collection_name.lower())
+    return f"ix_{safe_name}_embedding_{index_type}"[:63]
+
+
+def _embedding_expression(dimensions: int) -> sql.Composable:
+    # The embedding column has no fixed dimensions, so indexes and queries
+    # both use a cast to the collection's dimensions
+    return sql.SQL("(embedding::vector({}))").format(sql.Literal(dimensions))
+
+
+def create_ann_index(
+    conn: Connection,
+    collection_name: str,
+    index_type: str = "hnsw",
+    m: int = 16,
+    ef_construction: int = 64,
+    lists: int | None = None,
+    recreate: bool = False,
+    maintenance_work_mem: str | None = None,
+):
+    """
+    Create the ANN index of a collection after a bulk load.
+
+    The index is partial, covering only the rows of the collection, and uses
+    cosine distance like PGVector's default. HNSW indexes are maintained on
+    insert so they are only created when missing or when `recreate` is set,
+    IVFFlat lists are fitted to the data so they are always rebuilt.
+
+    Args:
+    ----
+        conn (Connection): Connection to the PGVector database.
+        collection_name (str): Name of the collection to index.
+        index_type (str): "hnsw" or "ivfflat".
+        m (int): HNSW max connections per layer.
+        ef_construction (int): HNSW candidate list size while building.
+        lists (int): IVFFlat lists. Defaults to rows / 1000, or sqrt(rows)
+            above 1M rows, as recommended by pgvector.
+        recreate (bool): Drop and rebuild an existing index, e.g. after the
+            collection was overwritten.
+        maintenance_work_mem (str): Memory for the build, e.g. "2GB".
+
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type}, expected one of {INDEX_TYPES}")
+    collection_id = get_collection_id(conn, collection_name)
+    dimensions = get_dimensions(conn, collection_id)
+    if dimensions is None:
+        logger.info(f"Collection {collection_name} is empty, skipping the ANN index")
+        return
+    index_name = sql.Identifier(ann_index_name(collection_name, index_type))
+
+    if index_type == "ivfflat":
+        recreate = True
+        if lists is None:
+            n_rows = conn.execute(
+                sql.SQL("SELECT count(*) FROM {} WHERE collection_id = %s").format(
+                    sql.Identifier(EMBEDDING_TABLE)
+                ),
+                (collection_id,),
+            ).fetchone()[0]
+            lists = max(n_rows // 1000 if n_rows <= 1_000_000 else int(math.sqrt(n_rows)), 1)
+        options = sql.SQL("WITH (lists = {})").format(sql.Literal(lists))
+    else:
+        options = sql.SQL("WITH (m = {}, ef_construction = {})").format(
+            sql.Literal(m), sql.Literal(ef_construction)
+        )
+
+    with conn.transaction():
+        if maintenance_work_mem:
+            conn.execute(
+                sql.SQL("SET LOCAL maintenance_work_mem = {}").format(
+                    sql.Literal(maintenance_work_mem)
+                )
+            )
+        if recreate:
+            conn.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(index_name))
+        logger.info(f"Creating {index_type} index on {collection_name} ({dimensions} dims)")
+        conn.execute(
+            sql.SQL(
+                "CREATE INDEX IF NOT EXISTS {index} ON {table} USING {method} "
+                "({embedding} vector_cosine_ops) {options} WHERE collection_id = {id}"
+            ).format(
+                index=index_name,
+                table=sql.Identifier(EMBEDDING_TABLE),
+                method=sql.SQL(index_type),
+                embedding=_embedding_expression(dimensions),
+                options=options,
+                id=sql.Literal(collection_id),
+            )
+        )
+
+
+def search_settings(
+    ef_search: int | None = None, probes: int | None = None
+) -> list[sql.Composable]:
+    """SET LOCAL statements tuning the recall/speed trade-off of a query."""
+    settings = []
+    if ef_search is not None:
+        settings.append(
+            sql.SQL("SET LOCAL hnsw.ef_search = {}").format(sql.Literal(ef_search))
+        )
+    if probes is not None:
+        settings.append(
+            sql.SQL("SET LOCAL ivfflat.probes = {}").format(sql.Literal(probes))
+        )
+    return settings
+
+
+def search_query(
+    collection_id: str,
+    dimensions: int,
+    filters: dict[str, str | list[str]] | None = None,
+) -> sql.Composable:
+    """
+    Nearest neighbour query of a collection, matching its ANN index.
+
+    The collection id and dimensions are inlined so the planner can match the
+    partial index, whose predicate is the same literal id; a lookup of the id
+    by name in the query itself would not match it. The query takes %(embedding)s, the embedding as a pgvector
+    literal such as '[0.1,0.2]', and %(k)s parameters, and returns id,
+    document, cmetadata and the cosine similarity of each row.
+    """
+    embedding = _embedding_expression(dimensions)
+    query_embedding = sql.SQL("%(embedding)s::vector({})").format(sql.Literal(dimensions))
+    conditions = [sql.SQL("collection_id = {}").format(sql.Literal(collection_id))]
+    # Values of a field are OR-ed, fields are AND-ed
+    for field, values in (filters or {}).items():
+        if isinstance(values, str):
+            values = [values]
+        conditions.append(
+            sql.SQL("({})").format(
+                sql.SQL(" OR ").join(
+                    sql.SQL("cmetadata @> {}::jsonb").format(
+                        sql.Literal(json.dumps({field: value}))
+                    )
+                    for value in values
+                )
+            )
+        )
+    return sql.SQL(
+        "SELECT id, document, cmetadata, 1 - ({embedding} <=> {query}) AS score "
+        "FROM {table} WHERE {conditions} "
+        "ORDER BY {embedding} <=> {query} LIMIT %(k)s"
+    ).format(
+        embedding=embedding,
+        query=query_embedding,
+        table=sql.Identifier(EMBEDDING_TABLE),
+        conditions=sql.SQL(" AND ").join(conditions),
+    )
+
+
+def to_pgvector(embedding) -> str:
+    """Format an embedding as a pgvector literal."""
+    return "[" + ",".join(f"{float(value):.7g}" for value in embedding) + "]"
@@ -0,0 +1,93 @@
+"""Opt-in sampling profiles of ingest stages and service requests."""
+
+import logging
+import pathlib
+import re
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import ContextManager
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FORMATS = ["speedscope", "html"]
+
+
+class StageProfiler:
+    """
+    Profile named stages into one file each, or do nothing when disabled.
+
+    Profiles are sampled with pyinstrument, an optional dependency that is
+    only imported once a stage is profiled, so a disabled profiler costs a
+    `nullcontext`. Without pyinstrument, stages run unprofiled. Speedscope files open in https://www.speedscope.app, HTML
+    files in a browser. Only one stage is profiled at a time; stages started
+    while another is being profiled, e.g. concurrent requests, run unprofiled.
+    """
+
+    def __init__(
+        self,
+        output_dir: pathlib.Path | None = None,
+        output_format: str = "speedscope",
+        interval: float = 0.001,
+    ):
+        if output_format not in PROFILE_FORMATS:
+            raise ValueError(
+                f"Unknown profile format {output_format}, expected one of {PROFILE_FORMATS}"
+            )
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.interval = interval
+        self._lock = threading.Lock()
+        # Cleared when pyinstrument turns out not to be installed
+        self.available = True
+
+    @property
+    def enabled(self) -> bool:
+        return self.output_dir is not None and self.available
+
+    def stage(self, name: str) -> ContextManager:
+        """Profile the wrapped block into a file named after the stage."""
+        if not self.enabled or not self._lock.acquire(blocking=False):
+            return nullcontext()
+        return self._profile(name)
+
+    @contextmanager
+    def _profile(self, name: str):
+        try:
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                Profiler = None
+            if Profiler is None:
+                # Logged once, as later stages are not profiled at all
+                self.available = False
+                logger.warning(
+                    "Profiling requires pyinstrument, install it with "
+                    "`pip install pyinstrument`, running unprofiled"
+                )
+                yield
+                return
+            profiler = Profiler(interval=self.interval, async_mode="enabled")
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                self._write(profiler, name)
+        finally:
+            self._lock.release()
+
+    def _write(self, profiler, name: str) -> pathlib.Path:
+        if self.output_format == "html":
+            extension, content = "html", profiler.output_html()
+        else:
+            from pyinstrument.renderers import SpeedscopeRenderer
+
+            extension = "speedscope.json"
+            content = profiler.output(renderer=SpeedscopeRenderer())
+        safe_name = re.sub(r"[^\w.-]", "_", name)
+        path = self.output_dir / f"{safe_name}-{datetime.now():%Y%m%d-%H%M%S-%f}.{extension}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding="utf-8")
+        logger.info(f"Profile of {name} written to {path}")
+        return path
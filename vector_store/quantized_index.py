@@ -0,0 +1,219 @@
+"""Vector index with quantized first-pass search and full precision rescoring."""
+
+import json
+import logging
+import pathlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATIONS = ["none", "int8", "binary"]
+
+# Candidates rescored per result by default. Sign codes rank candidates much
+# more coarsely than int8 codes, so binary needs a far deeper rescoring pass:
+# on the clustered vectors of `benchmark.py quantization` it reaches a recall@10
+# of about 0.89 over 20k vectors and 0.64 over 100k, against 1.0 for int8.
+DEFAULT_RESCORE_FACTORS = {"none": 1, "int8": 4, "binary": 256}
+
+# Number of set bits for every byte value, for numpy < 2.0 which lacks bitwise_count
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    """Count the set bits of each element."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT[values.view(np.uint8)].reshape(*values.shape, -1).sum(axis=-1)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2 normalize vectors so inner product equals cosine similarity."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.clip(norms, 1e-12, None)
+
+
+class QuantizedIndex:
+    """
+    Cosine similarity index over quantized codes.
+
+    Candidates are first ranked on compact codes kept in memory, either scalar
+    int8 codes (1 byte per dimension) or binary sign codes (1 bit per
+    dimension), then the best `rescore_factor * k` candidates are rescored
+    exactly against the float32 vectors, which are memory-mapped from disk
+    once the index is saved. `rescore_factor` is a search setting and isn't
+    saved with the index, it defaults to `DEFAULT_RESCORE_FACTORS`.
+    """
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        ids: list[str],
+        quantization: str = "int8",
+        rescore_factor: int | None = None,
+    ):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(
+                f"Unknown quantization {quantization}, expected one of {QUANTIZATIONS}"
+            )
+        if len(ids) != len(vectors):
+            raise ValueError(f"Got {len(ids)} ids for {len(vectors)} vectors")
+        self.vectors = vectors
+        self.ids = list(ids)
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor or DEFAULT_RESCORE_FACTORS[quantization]
+        self.offset = None
+        self.scale = None
+        self.codes = None
+        if quantization != "none":
+            self._quantize()
+
+    @classmethod
+    def from_embeddings(
+        cls, embeddings: dict[str, list[float]], **kwargs
+    ) -> "QuantizedIndex":
+        """Build an index from an id to embedding mapping."""
+        ids = list(embeddings)
+        vectors = normalize(np.array([embeddings[i] for i in ids], dtype=np.float32))
+        return cls(vectors, ids, **kwargs)
+
+    def _quantize(self):
+        """Compute the codes used for the first pass."""
+        if self.quantization == "binary":
+            self.codes = self._binary_codes(self.vectors)
+            return
+        # Map each dimension's [min, max] range onto [-127, 127]
+        low = self.vectors.min(axis=0)
+        high = self.vectors.max(axis=0)
+        self.scale = np.clip((high - low) / 254, 1e-12, None).astype(np.float32)
+        self.offset = ((high + low) / 2).astype(np.float32)
+        self.codes = np.clip(
+            np.rint((self.vectors - self.offset) / self.scale), -127, 127
+        ).astype(np.int8)
+
+    @staticmethod
+    def _binary_codes(vectors: np.ndarray) -> np.ndarray:
+        """Pack the signs of the vectors into 64 bit words."""
+        bits = np.packbits(vectors > 0, axis=1)
+        padding = -bits.shape[1] % 8
+        bits = np.pad(bits, ((0, 0), (0, padding)))
+        return np.ascontiguousarray(bits).view(np.uint64)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> dict[str, int]:
+        """Bytes held in memory for the first pass and on disk for rescoring."""
+        codes = self.vectors if self.codes is None else self.codes
+        return {"search": int(codes.nbytes), "full_precision": int(self.vectors.nbytes)}
+
+    def _first_pass(
+        self, queries: np.ndarray, rows: np.ndarray | None, block_size: int = 65536
+    ) -> np.ndarray:
+        """Approximate scores of every (query, row) pair, higher is better."""
+        codes = self.vectors if self.codes is None else self.codes
+        if rows is not None:
+            codes = codes[rows]
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        if self.quantization == "binary":
+            # Negated hamming distance between the sign codes
+            query_codes = self._binary_codes(queries)
+            for i, query_code in enumerate(query_codes):
+                distance = _popcount(np.bitwise_xor(codes, query_code))
+                scores[i] = -distance.sum(axis=1, dtype=np.int32)
+            return scores
+
+        if self.quantization == "int8":
+            # q . (codes * scale + offset) = (q * scale) . codes + q . offset
+            scaled = queries * self.scale
+            bias = queries @ self.offset
+        else:
+            scaled, bias = queries, 0
+        for start in range(0, len(codes), block_size):
+            block = codes[start : start + block_size].astype(np.float32)
+            scores[:, start : start + block_size] = scaled @ block.T
+        return scores + np.reshape(bias, (-1, 1))
+
+    def search(
+        self, queries: np.ndarray, k: int = 10, rows: np.ndarray | None = None
+    ) -> list[list[tuple[str, float]]]:
+        """
+        Find the k nearest vectors of each query.
+
+        Args:
+        ----
+            queries (np.ndarray): One query vector or a matrix of query vectors.
+            k (int): Number of results per query.
+            rows (np.ndarray): Restrict the search to these row positions.
+
+        Returns:
+        -------
+            list: For each query, (id, cosine similarity) pairs, best first.
+
+        """
+        queries = normalize(np.atleast_2d(queries))
+        n_rows = len(self) if rows is None else len(rows)
+        if n_rows == 0:
+            return [[] for _ in queries]
+        scores = self._first_pass(queries, rows)
+
+        if self.codes is None:
+            n_candidates = n_rows
+        else:
+            n_candidates = min(n_rows, k * self.rescore_factor)
+        k = min(k, n_candidates)
+        results = []
+        for query, query_scores in zip(queries, scores):
+            positions = np.argpartition(-query_scores, n_candidates - 1)[:n_candidates]
+            candidates = positions if rows is None else rows[positions]
+            if self.codes is None:
+                exact = query_scores[positions]
+            else:
+                # Rescore against the full precision vectors, reading them in
+                # row order to keep memory-mapped access sequential
+                order = np.argsort(candidates)
+                candidates = candidates[order]
+                exact = self.vectors[candidates] @ query
+            best = np.argsort(-exact)[:k]
+            results.append([(self.ids[candidates[i]], float(exact[i])) for i in best])
+        return results
+
+    def save(self, path: pathlib.Path):
+        """Write the index to a folder."""
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "vectors.npy", self.vectors)
+        if self.codes is not None:
+            np.save(path / "codes.npy", self.codes)
+        if self.scale is not None:
+            np.save(path / "scale.npy", self.scale)
+            np.save(path / "offset.npy", self.offset)
+        with (path / "index.json").open("w", encoding="utf-8") as f:
+            json.dump(
+                {"quantization": self.quantization, "ids": self.ids},
+                f,
+            )
+        logger.info(f"Saved {len(self)} vectors ({self.quantization}) to {path}")
+
+    @classmethod
+    def load(
+        cls, path: pathlib.Path, rescore_factor: int | None = None
+    ) -> "QuantizedIndex":
+        """Load an index, keeping the full precision vectors on disk."""
+        with (path / "index.json").open("r", encoding="utf-8") as f:
+            info = json.load(f)
+        index = cls.__new__(cls)
+        index.vectors = np.load(path / "vectors.npy", mmap_mode="r")
+        index.ids = info["ids"]
+        index.quantization = info["quantization"]
+        index.rescore_factor = (
+            rescore_factor or DEFAULT_RESCORE_FACTORS[index.quantization]
+        )
+        index.codes = index.scale = index.offset = None
+        if (path / "codes.npy").exists():
+            index.codes = np.load(path / "codes.npy")
+        if (path / "scale.npy").exists():
+            index.scale = np.load(path / "scale.npy")
+            index.offset = np.load(path / "offset.npy")
+        return index
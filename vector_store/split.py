@@ -1,76 +1,89 @@
+import functools
+import json
 import logging
 import os
 import pathlib
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 from langchain.docstore.document import Document
-from langchain.text_splitter import Language, RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import (
-    CSVLoader,
-    Docx2txtLoader,
-    PDFMinerLoader,
-    TextLoader,
-    UnstructuredExcelLoader,
-    UnstructuredPowerPointLoader,
+from langchain.text_splitter import (
+    Language,
+    RecursiveCharacterTextSplitter,
+    TextSplitter,
 )
+from langchain_core.document_loaders import BaseLoader
 
+# Loaders are named rather than imported, as most of them pull in heavy
+# parsing libraries, and are imported by get_loader on first use
 DOCUMENT_MAP = {
     ".txt": {
-        "loader": TextLoader,
+        "loader": "TextLoader",
         "language": None,
     },
     ".html": {
-        "loader": TextLoader,
-        "language": Language.HTML,
+        # Main content only, with headings as markdown for the splitter
+        "loader": "HTMLTextLoader",
+        "language": Language.MARKDOWN,
     },
     ".md": {
-        "loader": TextLoader,
+        "loader": "TextLoader",
         "language": Language.MARKDOWN,
     },
     ".py": {
-        "loader": TextLoader,
+        "loader": "TextLoader",
         "language": Language.PYTHON,
     },
     ".pdf": {
-        "loader": PDFMinerLoader,
+        "loader": "PDFMinerLoader",
         "language": None,
     },
     ".csv": {
-        "loader": CSVLoader,
+        "loader": "CSVLoader",
     },
     ".xls": {
-        "loader": UnstructuredExcelLoader,
+        "loader": "UnstructuredExcelLoader",
     },
     ".xlsx": {
-        "loader": UnstructuredExcelLoader,
+        "loader": "UnstructuredExcelLoader",
     },
     ".docx": {
-        "loader": Docx2txtLoader,
+        "loader": "Docx2txtLoader",
         "language": None,
     },
     ".doc": {
-        "loader": Docx2txtLoader,
+        "loader": "Docx2txtLoader",
         "language": None,
     },
     ".pptx": {
-        "loader": UnstructuredPowerPointLoader,
+        "loader": "UnstructuredPowerPointLoader",
     },
     ".ppt": {
-        "loader": UnstructuredPowerPointLoader,
+        "loader": "UnstructuredPowerPointLoader",
     },
 }
 
 
+@functools.cache
+def get_loader(file_extension: str) -> type[BaseLoader]:
+    """Import the loader class of a file type."""
+    ext_metadata = DOCUMENT_MAP.get(file_extension)
+    if not ext_metadata:
+        raise ValueError("Document type is undefined")
+    loader_name = ext_metadata["loader"]
+    if loader_name == "HTMLTextLoader":
+        from html_loader import HTMLTextLoader
+
+        return HTMLTextLoader
+    from langchain_community import document_loaders
+
+    return getattr(document_loaders, loader_name)
+
+
 def load_single_document(file_path: str) -> tuple[str, list[Document]]:
     """Load a single document from a file path."""
     logging.info(f"Loading {file_path}")
     file_extension = os.path.splitext(file_path)[1]
-    ext_metadata = DOCUMENT_MAP.get(file_extension)
-    if ext_metadata:
-        loader_class = ext_metadata.get("loader")
-        loader = loader_class(file_path)
-    else:
-        raise ValueError("Document type is undefined")
+    loader = get_loader(file_extension)(file_path)
     return file_extension, loader.load()
 
 
@@ -119,26 +132,153 @@ def load_documents(source_dir: pathlib.Path, ingest_threads: int) -> list[Docume
     return docs
 
 
-def split_document(
-    document: Document, file_extension: str, chunk_size: int, chunk_overlap: int
-):
-    """Split a document into chunks."""
+@functools.cache
+def _get_tokenizer(tokenizer_name: str):
+    """Load a Hugging Face tokenizer once per process."""
+    from transformers import AutoTokenizer
+
+    from onnx_embeddings import resolve_model_name
+
+    return AutoTokenizer.from_pretrained(resolve_model_name(tokenizer_name))
+
+
+@functools.cache
+def get_token_window(tokenizer_name: str) -> int | None:
+    """
+    Number of text tokens the embedding model reads, longer chunks are truncated.
+
+    sentence-transformers models truncate to the `max_seq_length` of their
+    config, e.g. 256 for all-MiniLM-L6-v2, which is often shorter than the
+    tokenizer's `model_max_length`. Both count the special tokens the model
+    adds, which chunk sizes don't.
+    """
+    from huggingface_hub import hf_hub_download
+    from huggingface_hub.errors import EntryNotFoundError
+
+    from onnx_embeddings import resolve_model_name
+
+    tokenizer = _get_tokenizer(tokenizer_name)
+    try:
+        config_path = hf_hub_download(
+            resolve_model_name(tokenizer_name), "sentence_bert_config.json"
+        )
+        with open(config_path, encoding="utf-8") as f:
+            max_length = json.load(f)["max_seq_length"]
+    except (EntryNotFoundError, OSError, KeyError):
+        max_length = tokenizer.model_max_length
+    # Tokenizers without a limit report a huge placeholder
+    if max_length > 1_000_000:
+        return None
+    return max_length - tokenizer.num_special_tokens_to_add()
+
+
+@functools.cache
+def get_splitter(
+    file_extension: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    tokenizer_name: str | None = None,
+) -> TextSplitter | None:
+    """
+    Get the splitter for a file type, built once per process and then reused.
+
+    Args:
+    ----
+        file_extension (str): Extension of the file type, one of DOCUMENT_MAP.
+        chunk_size (int): Maximum chunk size, in characters or in tokens.
+        chunk_overlap (int): Overlap between chunks, in the same unit.
+        tokenizer_name (str): When set, measure chunks in tokens of this model's
+            tokenizer, typically the embedding model, instead of characters.
+
+    Returns:
+    -------
+        TextSplitter: The splitter, or None if the file type isn't chunked.
+
+    """
     ext_metadata = DOCUMENT_MAP.get(file_extension)
     # If there is no language defined, don't chunk the text
     if "language" not in ext_metadata:
-        chunks = [document]
+        return None
+    kwargs = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
     # If there is a language defined, chunk the text according to the language
-    else:
-        language = ext_metadata["language"]
-        # If the language is None, use the basic splitter
-        if language is None:
-            splitter = RecursiveCharacterTextSplitter(
-                chunk_size=chunk_size, chunk_overlap=chunk_overlap
-            )
-        # Otherwise use the specific language
-        else:
-            splitter = RecursiveCharacterTextSplitter.from_language(
-                language=language, chunk_size=chunk_size, chunk_overlap=chunk_overlap
-            )
-        chunks = splitter.split_documents(documents=[document])
-    return chunks
+    language = ext_metadata["language"]
+    if language is not None:
+        separators = RecursiveCharacterTextSplitter.get_separators_for_language(language)
+        kwargs["separators"] = separators
+        kwargs["is_separator_regex"] = True
+    if tokenizer_name is None:
+        return RecursiveCharacterTextSplitter(**kwargs)
+    return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        _get_tokenizer(tokenizer_name), **kwargs
+    )
+
+
+def split_document(
+    document: Document,
+    file_extension: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    tokenizer_name: str | None = None,
+) -> list[Document]:
+    """Split a document into chunks."""
+    splitter = get_splitter(file_extension, chunk_size, chunk_overlap, tokenizer_name)
+    if splitter is None:
+        return [document]
+    return splitter.split_documents(documents=[document])
+
+
+def _split_document_batch(
+    batch: list[tuple[str, Document]],
+    chunk_size: int,
+    chunk_overlap: int,
+    tokenizer_name: str | None,
+) -> list[list[Document]]:
+    """Split a batch of documents in a worker process."""
+    return [
+        split_document(document, extension, chunk_size, chunk_overlap, tokenizer_name)
+        for extension, document in batch
+    ]
+
+
+def split_documents(
+    documents: list[tuple[str, Document]],
+    chunk_size: int,
+    chunk_overlap: int,
+    tokenizer_name: str | None = None,
+    workers: int = 1,
+    batch_size: int = 64,
+) -> list[list[Document]]:
+    """
+    Split many documents, in a process pool when `workers` is more than one.
+
+    Args:
+    ----
+        documents (list): (file extension, document) pairs.
+        chunk_size (int): Maximum chunk size, in characters or in tokens.
+        chunk_overlap (int): Overlap between chunks, in the same unit.
+        tokenizer_name (str): Tokenizer to measure chunks with, see `get_splitter`.
+        workers (int): Number of worker processes.
+        batch_size (int): Number of documents sent to a worker at a time.
+
+    Returns:
+    -------
+        list: The chunks of each document, in the order of `documents`.
+
+    """
+    batches = [
+        documents[i : i + batch_size] for i in range(0, len(documents), batch_size)
+    ]
+    split_batch = functools.partial(
+        _split_document_batch,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        tokenizer_name=tokenizer_name,
+    )
+    n_workers = min(workers, len(batches))
+    if n_workers <= 1:
+        results = map(split_batch, batches)
+        return [chunks for batch in results for chunks in batch]
+    logging.info(f"Splitting {len(documents)} documents with {n_workers} workers")
+    with ProcessPoolExecutor(n_workers) as executor:
+        results = executor.map(split_batch, batches)
+        return [chunks for batch in results for chunks in batch]
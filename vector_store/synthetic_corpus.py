@@ -0,0 +1,282 @@
+"""Synthetic knowledge corpora for benchmarking the ingest pipeline."""
+
+import csv
+import logging
+import pathlib
+import random
+import zipfile
+from typing import Any
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIX = {".pdf": 0.4, ".html": 0.3, ".docx": 0.2, ".csv": 0.1}
+ORIGINS = ["source", "policies", "engineering", "people"]
+DEPARTMENTS = ["operations", "it", "finance", "legal", "marketing", "sales"]
+
+_WORDS = (
+    "access account agent answer approval associate badge benefit budget calendar "
+    "change channel cluster compliance config contract customer deploy desk device "
+    "document employee expense guide holiday incident install invoice issue laptop "
+    "leave license manager meeting network office onboarding password payroll policy "
+    "portal process product project release request review role security server "
+    "service support system team ticket training travel update upgrade vacation vpn "
+    "workflow workspace"
+).split()
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    """Parse a mix such as 'pdf=0.5,html=0.5' into normalized extension weights."""
+    weights = {}
+    for item in mix.split(","):
+        extension, _, weight = item.partition("=")
+        extension = "." + extension.strip().lstrip(".")
+        if extension not in WRITERS:
+            raise ValueError(
+                f"Unsupported extension {extension}, expected one of {sorted(WRITERS)}"
+            )
+        weights[extension] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError(f"Invalid document mix {mix}")
+    return {extension: weight / total for extension, weight in weights.items()}
+
+
+def _sentence(rng: random.Random) -> str:
+    words = rng.choices(_WORDS, k=rng.randint(6, 18))
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraphs(rng: random.Random, n_paragraphs: int) -> list[str]:
+    return [
+        " ".join(_sentence(rng) for _ in range(rng.randint(3, 8)))
+        for _ in range(n_paragraphs)
+    ]
+
+
+def synthetic_texts(
+    n_texts: int, min_sentences: int = 1, max_sentences: int = 8, seed: int = 0
+) -> list[str]:
+    """Generate chunk or query sized texts."""
+    rng = random.Random(seed)
+    return [
+        " ".join(
+            _sentence(rng) for _ in range(rng.randint(min_sentences, max_sentences))
+        )
+        for _ in range(n_texts)
+    ]
+
+
+def synthetic_vectors(
+    n_vectors: int, dim: int = 384, n_clusters: int = 100, seed: int = 0
+):
+    """Generate clustered unit vectors shaped like sentence embeddings."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n_vectors)
+    vectors = centers[labels] + 0.6 * rng.normal(size=(n_vectors, dim)).astype(
+        np.float32
+    )
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _write_txt(path: pathlib.Path, title: str, paragraphs: list[str]):
+    path.write_text("\n\n".join([title] + paragraphs), encoding="utf-8")
+
+
+def _write_md(path: pathlib.Path, title: str, paragraphs: list[str]):
+    lines = [f"# {title}"]
+    for i, paragraph in enumerate(paragraphs):
+        if i % 3 == 0:
+            lines.append(f"## Section {i // 3 + 1}")
+        lines.append(paragraph)
+    path.write_text("\n\n".join(lines), encoding="utf-8")
+
+
+def _write_html(path: pathlib.Path, title: str, paragraphs: list[str]):
+    # Mimic a scraped Source page: navigation chrome, scripts and styles around
+    # the main content region.
+    nav = "".join(f'<li><a href="/{word}">{word}</a></li>' for word in _WORDS[:40])
+    body = []
+    for i, paragraph in enumerate(paragraphs):
+        if i % 3 == 0:
+            body.append(f"<h2>Section {i // 3 + 1}</h2>")
+        body.append(f"<p>{escape(paragraph)}</p>")
+    html = (
+        "<!DOCTYPE html><html><head>"
+        f"<title>{escape(title)}</title>"
+        "<style>body{font-family:sans-serif}.nav li{display:inline}</style>"
+        "<script>window.analytics={track:function(){return true}};</script>"
+        "</head><body>"
+        f'<header><nav class="nav"><ul>{nav}</ul></nav></header>'
+        f"<main><article><h1>{escape(title)}</h1>{''.join(body)}</article></main>"
+        f'<footer><ul class="nav">{nav}</ul><p>Copyright Red Hat</p></footer>'
+        "</body></html>"
+    )
+    path.write_text(html, encoding="utf-8")
+
+
+def _write_csv(path: pathlib.Path, title: str, paragraphs: list[str]):
+    with path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "topic", "description"])
+        for i, paragraph in enumerate(paragraphs):
+            for j, sentence in enumerate(paragraph.split(". ")):
+                writer.writerow([f"{i}-{j}", title, sentence])
+
+
+def _write_docx(path: pathlib.Path, title: str, paragraphs: list[str]):
+    runs = "".join(
+        f"<w:p><w:r><w:t>{escape(text)}</w:t></w:r></w:p>"
+        for text in [title] + paragraphs
+    )
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{runs}</w:body></w:document>"
+    )
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/word/document.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+        "</Types>"
+    )
+    rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="word/document.xml"/>'
+        "</Relationships>"
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", content_types)
+        docx.writestr("_rels/.rels", rels)
+        docx.writestr("word/document.xml", document)
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _write_pdf(path: pathlib.Path, title: str, paragraphs: list[str]):
+    # Lay the text out as fixed-width lines, 50 lines per page, and write a
+    # minimal PDF with one content stream per page.
+    lines = [title, ""]
+    for paragraph in paragraphs:
+        words, line = paragraph.split(), ""
+        for word in words:
+            if len(line) + len(word) + 1 > 90:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}".strip()
+        lines.extend([line, ""])
+    pages = [lines[i : i + 50] for i in range(0, len(lines), 50)]
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, None]
+    objects[2] = "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    page_ids = []
+    for page in pages:
+        text = "\n".join(f"({_pdf_escape(line)}) Tj T*" for line in page)
+        stream = f"BT /F1 10 Tf 14 TL 50 780 Td\n{text}\nET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        content_id = len(objects)
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>"
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{i} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        output += f"{offset:010d} 00000 n \n".encode("latin-1")
+    output += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+        f"startxref\n{xref}\n%%EOF\n"
+    ).encode("latin-1")
+    path.write_bytes(bytes(output))
+
+
+WRITERS = {
+    ".txt": _write_txt,
+    ".md": _write_md,
+    ".html": _write_html,
+    ".csv": _write_csv,
+    ".docx": _write_docx,
+    ".pdf": _write_pdf,
+}
+
+
+def generate_corpus(
+    output_dir: pathlib.Path,
+    n_documents: int,
+    mix: dict[str, float] = DEFAULT_MIX,
+    min_paragraphs: int = 3,
+    max_paragraphs: int = 30,
+    duplicate_rate: float = 0.0,
+    seed: int = 0,
+) -> dict[pathlib.Path, dict[str, Any]]:
+    """
+    Write a synthetic corpus laid out like the knowledge folder.
+
+    Files are spread over a few origin folders (the first path segment under
+    `output_dir`) and every file gets source-style metadata, so the returned
+    lookup can be passed straight to `ingest` as `meta_lookup`.
+
+    Args:
+    ----
+        output_dir (pathlib.Path): Folder to write the corpus to.
+        n_documents (int): Number of documents to generate.
+        mix (dict): Extension to weight, e.g. {".pdf": 0.5, ".html": 0.5}.
+        min_paragraphs (int): Minimum paragraphs per document.
+        max_paragraphs (int): Maximum paragraphs per document.
+        duplicate_rate (float): Fraction of documents that are near copies of an
+            earlier document published under another url, with one sentence changed.
+        seed (int): Random seed, the same seed always yields the same corpus.
+
+    """
+    rng = random.Random(seed)
+    extensions = list(mix)
+    weights = [mix[extension] for extension in extensions]
+    meta_lookup = {}
+    written = []
+    for i in range(n_documents):
+        extension = rng.choices(extensions, weights=weights)[0]
+        origin = rng.choice(ORIGINS)
+        department = rng.choice(DEPARTMENTS)
+        if written and rng.random() < duplicate_rate:
+            extension, title, paragraphs = rng.choice(written)
+            paragraphs = list(paragraphs)
+            paragraphs[-1] = paragraphs[-1] + " " + _sentence(rng)
+        else:
+            title = " ".join(rng.choices(_WORDS, k=3)).title()
+            paragraphs = _paragraphs(rng, rng.randint(min_paragraphs, max_paragraphs))
+            written.append((extension, title, paragraphs))
+
+        url_path = f"{origin}/departments/{department}/doc-{i}"
+        path = output_dir / url_path / f"{title.replace(' ', '_')}{extension}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        WRITERS[extension](path, title, paragraphs)
+
+        meta_lookup[path] = {
+            "title": title,
+            "department": department,
+            "url": f"https://source.redhat.com/{url_path}",
+        }
+
+    logger.info(f"Generated {n_documents} synthetic documents in {output_dir}")
+    return meta_lookup
@@ -6,9 +6,7 @@ import pathlib
 from typing import Any, List
 import yaml
 
-from ingest_data import ingest
-from knowledge_source import fetchall as fetch_source
-from delete_knowledge import delete_knowledge
+from profiling import PROFILE_FORMATS, StageProfiler
 
 logger = logging.getLogger(__name__)
 
@@ -37,8 +35,16 @@ def main(args: argparse.Namespace) -> None:
     Args:
         args: Parsed arguments containing the config file path.
     """
+    # Imported here so --help doesn't load the ingest pipeline's dependencies
+    from delete_knowledge import delete_knowledge
+    from ingest_data import ingest
+    from knowledge_source import fetchall as fetch_source
+
     config_path = args.config
     config: dict = parse_config(config_path)
+    profiler = StageProfiler(
+        args.profile_dir if args.profile else None, output_format=args.profile_format
+    )
     ingest_threads = config.get("ingest_threads", 8)
     collections = config.get("collections", [])
     errors: List[Exception] = []
@@ -55,11 +61,18 @@ def main(args: argparse.Namespace) -> None:
             embedding_model_name = collection.get(
                 "embedding_model", "sentence-transformers/all-MiniLM-L6-v2"
             )
+            chunk_unit = collection.get("chunk_unit", "characters")
+            embedding_backend = collection.get("embedding_backend", "huggingface")
+            embedding_workers = collection.get("embedding_workers", 1)
+            dedup = collection.get("dedup", False)
+            dedup_threshold = collection.get("dedup_threshold", 0.9)
+            ann_index = collection.get("ann_index")
             metadata = collection.get("metadata", {})
             sources = collection.get("sources", [])
             meta_lookup: dict[pathlib.Path, dict[Any, Any]] = {}
             for source in sources:
-                source_meta_lookup = fetch_source(**source)
+                with profiler.stage(f"{name}-fetch"):
+                    source_meta_lookup = fetch_source(**source)
             meta_lookup = meta_lookup | source_meta_lookup
             ingest(
                 meta_lookup=meta_lookup,
@@ -67,9 +80,16 @@ def main(args: argparse.Namespace) -> None:
                 chunk_size=chunk_size,
                 chunk_overlap=chunk_overlap,
                 ingest_threads=ingest_threads,
+                chunk_unit=chunk_unit,
                 embedding_model_name=embedding_model_name,
+                embedding_backend=embedding_backend,
+                embedding_workers=embedding_workers,
                 mode=mode,
                 collection_metadata=metadata,
+                dedup=dedup,
+                dedup_threshold=dedup_threshold,
+                ann_index=ann_index,
+                profiler=profiler,
             )
         except Exception as e:
             logger.error(
@@ -98,4 +118,21 @@ if __name__ == "__main__":
         help="Path to config file.",
         default=pathlib.Path("./config/config.yaml"),
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write a sampling profile of each ingest stage (requires pyinstrument).",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        type=pathlib.Path,
+        help="Folder to write profiles to.",
+        default=pathlib.Path("./logs/profiles"),
+    )
+    parser.add_argument(
+        "--profile-format",
+        choices=PROFILE_FORMATS,
+        help="speedscope JSON or a pyinstrument HTML flame graph.",
+        default="speedscope",
+    )
     main(parser.parse_args())